@@ -0,0 +1,159 @@
+"""
+Running many convos without a user.
+
+Usage:
+  hallmoot batch <pattern> [--turns=<file>] [--jobs=<n>] [--rounds=<n>]
+                 [--timeout=<s>] [--executor=<kind>] [--report=<file>]
+  hallmoot batch -h | --help
+
+Options:
+  -h --help          Show this screen.
+  --turns=<file>     User messages to send to every convo, in order: a YAML
+                     list, or a text file of one message per line.
+  --jobs=<n>         Convos run at a time [default: 4].
+  --rounds=<n>       Most model rounds per convo [default: 50].
+  --timeout=<s>      Seconds a convo may run [default: 600].
+  --executor=<kind>  'thread' or 'process' workers [default: thread].
+  --report=<file>    Where the JSON summary goes [default: batch-report.json].
+
+Every convo matching the glob <pattern> is a job.  Its script is the file
+given with --turns, or else the list in its own `turns` header key.  A job
+first finishes a round left pending (the convo ends with a user or tool
+message), then sends each turn of the script that it does not hold yet
+and runs rounds until the model stops calling tools.  Scripted turns
+already in the convo, in order, are skipped, so an interrupted batch picks
+up where it stopped when run again.
+
+A job stops once it has used its rounds or its time.  The time limit
+also bounds each request to ollama and each build run_make starts, and
+tool calls left when it runs out are answered with an error; a model
+round cut short is dropped and rerun on resume.  The report lists, per
+convo, its status, rounds, turns sent, seconds and the token counts
+ollama reported.
+"""
+import os
+import sys
+import json
+import glob
+import time
+
+class _stop(Exception):
+    '''Ends a job early; the argument is its status.'''
+
+def _script(path):
+    with open(path) as f:
+        text = f.read()
+    if os.path.splitext(path)[1] in ('.yml', '.yaml', '.json'):
+        import yaml
+        return [str(turn) for turn in yaml.safe_load(text) or []]
+    return [line for line in text.splitlines() if line.strip()]
+
+def _done(messages, turns) -> int:
+    '''How many turns of the script the convo already holds, in order.'''
+    k = 0
+    for i in range(len(messages)):
+        if k < len(turns) and messages.role(i) == 'user' and messages[i].get('content') == turns[k]:
+            k += 1
+    return k
+
+def run_job(filename, turns=None, rounds=50, timeout=600.0) -> dict:
+    '''Run one convo to the end of its script; return its report entry.'''
+    from hallmoot import hallmoot
+    started = time.monotonic()
+    deadline = started + timeout
+    result = {'convo': filename, 'status': 'done', 'rounds': 0, 'turns': 0,
+              'tool_calls': 0, 'prompt_eval_count': 0, 'eval_count': 0}
+    def check():
+        if time.monotonic() > deadline:
+            raise _stop('timeout')
+    def tally(record):
+        result['tool_calls'] += record['counters'].get('tool_calls', 0)
+        for k in ('prompt_eval_count', 'eval_count'):
+            result[k] += record.get(k) or 0
+    def finish():
+        # rounds until the model stops calling tools
+        while True:
+            if result['rounds'] >= rounds:
+                raise _stop('rounds')
+            check()
+            result['rounds'] += 1
+            if not hm.user_round():
+                return
+    hm = None
+    try:
+        hm = hallmoot(filename)
+        # hallmoot enforces the deadline itself; raising from the display
+        # would escape procpool through its output sink mid-build
+        hm.deadline = deadline
+        hm.display_user = lambda text: None
+        hm.metrics.hooks.append(tally)
+        if turns is None:
+            turns = [str(turn) for turn in hm.convo.get('turns', [])]
+        messages = hm.messages
+        if len(messages) and messages.role(len(messages) - 1) in ('user', 'tool'):
+            finish()
+        for turn in turns[_done(messages, turns):]:
+            message = {'role': 'user', 'content': turn}
+            messages.append(message)
+            hm._persist_message(message)
+            result['turns'] += 1
+            finish()
+    except _stop as e:
+        result['status'] = e.args[0]
+    except Exception as e:
+        import httpx
+        if isinstance(e, (TimeoutError, httpx.TimeoutException)):
+            result['status'] = 'timeout'
+        else:
+            result['status'] = f'error: {e}'
+    finally:
+        if hm is not None:
+            hm.close()
+    result['seconds'] = round(time.monotonic() - started, 3)
+    return result
+
+def run(filenames, turns=None, jobs=4, rounds=50, timeout=600.0, executor='thread') -> list:
+    '''Run the convos over a pool of workers; return their reports in order.'''
+    from concurrent import futures
+    if executor not in ('thread', 'process'):
+        raise ValueError(f"Unknown executor {executor!r}")
+    if executor == 'process':
+        import multiprocessing
+        # fresh interpreters: forked ones would share our pooled connections
+        pool = futures.ProcessPoolExecutor(jobs, multiprocessing.get_context('spawn'))
+    else:
+        pool = futures.ThreadPoolExecutor(jobs)
+    results = {}
+    with pool:
+        running = {pool.submit(run_job, f, turns, rounds, timeout): f for f in filenames}
+        for f in futures.as_completed(running):
+            r = results[running[f]] = f.result()
+            print(f"{r['status']:>8} {r['seconds']:8.1f}s {r['rounds']:4} rounds "
+                  f"{r['eval_count']:7} tok  {r['convo']}", file=sys.stderr)
+    return [results[f] for f in filenames]
+
+def main(argv=None):
+    import docopt
+    args = docopt.docopt(__doc__, argv)
+    filenames = sorted(f for f in glob.glob(args['<pattern>'], recursive=True)
+                       if os.path.isfile(f) and not f.endswith('.idx'))
+    if not filenames:
+        raise SystemExit(f"No convos match {args['<pattern>']}")
+    turns = _script(args['--turns']) if args['--turns'] else None
+    started = time.time()
+    t = time.monotonic()
+    jobs = run(filenames, turns, int(args['--jobs']), int(args['--rounds']),
+               float(args['--timeout']), args['--executor'])
+    report = {'started': started, 'seconds': round(time.monotonic() - t, 3), 'jobs': jobs,
+              'totals': {k: sum(j[k] for j in jobs) for k in
+                         ('rounds', 'turns', 'tool_calls', 'prompt_eval_count', 'eval_count')}}
+    report['totals']['status'] = {s: sum(j['status'] == s for j in jobs)
+                                  for s in sorted({j['status'] for j in jobs})}
+    with open(args['--report'], 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"{len(jobs)} convos in {report['seconds']:.1f}s: {report['totals']['status']}; "
+          f"report in {args['--report']}", file=sys.stderr)
+    if any(j['status'].startswith('error') for j in jobs):
+        raise SystemExit(1)
+
+if __name__ == '__main__': main(['batch', *sys.argv[1:]])
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+'''
+A stand-in for the ollama HTTP server, for benchmarks.
+
+Usage: mockollama.py [--port=<port>] [--tokens=<n>] [--rate=<tok/s>]
+                     [--latency=<s>] [--tool-calls=<n>] [--tool=<name>]
+
+Streams scripted /api/chat responses: after `latency` seconds, `tokens`
+tokens at `rate` tokens per second (or, for "stream": false, sends them as
+one response once they are all generated).  When the last message is from the
+user and --tool-calls is set, the reply is that many calls of --tool
+instead, one chunk each spread over the time of `tokens` tokens, so a round
+with tools takes two requests.  /api/version and
+/api/tags answer health checks.
+'''
+import json
+import sys
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class script:
+    port = 11500
+    tokens = 50
+    rate = 1000.0
+    latency = 0.0
+    tool_calls = 0
+    tool = 'read_file'
+    arguments = {'filepath': 'big.txt'}
+
+def _chunk(content='', done=False, **extra):
+    message = {'role': 'assistant', 'content': content}
+    if 'tool_calls' in extra:
+        message['tool_calls'] = extra.pop('tool_calls')
+    return dict(model='mock', created_at='2024-01-01T00:00:00Z',
+                message=message, done=done, **extra)
+
+def _reply(messages):
+    '''The chunks of a scripted reply to messages, as they are generated.'''
+    if script.tool_calls and messages and messages[-1].get('role') == 'user':
+        # one call per chunk, as the tokens that spell them are generated
+        call = {'function': {'name': script.tool, 'arguments': script.arguments}}
+        for i in range(script.tool_calls):
+            if script.rate:
+                time.sleep(script.tokens / script.tool_calls / script.rate)
+            yield _chunk(tool_calls=[call])
+    else:
+        for i in range(script.tokens):
+            yield _chunk(f'tok{i} ')
+            if script.rate:
+                time.sleep(1 / script.rate)
+
+class handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = 0
+    lock = threading.Lock()
+    def log_message(self, *args):
+        pass
+    def _json(self, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def do_GET(self):
+        if self.path == '/api/version':
+            return self._json({'version': 'mock'})
+        if self.path == '/api/tags':
+            return self._json({'models': [{'name': 'mock'}]})
+        self.send_error(404)
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        with handler.lock:
+            handler.requests += 1
+        if self.path != '/api/chat':
+            return self.send_error(404)
+        messages = request.get('messages') or []
+        prompt = sum(len(str(m.get('content', ''))) for m in messages) // 4
+        stream = request.get('stream', True)
+        started = time.monotonic()
+        if stream:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+        time.sleep(script.latency)
+        contents, calls, count = [], [], 0
+        for chunk in _reply(messages):
+            count += 1
+            if stream:
+                self._send(chunk)
+            else:
+                contents.append(chunk['message']['content'])
+                calls += chunk['message'].get('tool_calls', [])
+        ns = int((time.monotonic() - started) * 1e9)
+        done = _chunk(done=True, done_reason='stop', total_duration=ns, load_duration=0,
+                      prompt_eval_count=prompt, prompt_eval_duration=0,
+                      eval_count=count, eval_duration=ns)
+        if not stream:
+            # one object holding the whole reply, as ollama answers "stream": false
+            done['message']['content'] = ''.join(contents)
+            if calls:
+                done['message']['tool_calls'] = calls
+            return self._json(done)
+        self._send(done)
+        self.wfile.write(b'0\r\n\r\n')
+    def _send(self, obj):
+        data = json.dumps(obj).encode() + b'\n'
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+def serve(port=None, **settings):
+    '''Start a server in a background thread and return it.'''
+    for k, v in settings.items():
+        setattr(script, k, v)
+    server = ThreadingHTTPServer(('127.0.0.1', script.port if port is None else port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    for arg in sys.argv[1:]:
+        if not arg.startswith('--') or '=' not in arg:
+            raise SystemExit(__doc__)
+        k, v = arg[2:].split('=', 1)
+        k = k.replace('-', '_')
+        setattr(script, k, type(getattr(script, k))(v))
+    server = serve()
+    print(f'mock ollama on 127.0.0.1:{server.server_address[1]}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__': main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+'''
+Benchmarks for hallmoot's own overhead, against a stand-in ollama server.
+
+Usage: run.py [<scenario>...]
+
+Scenarios (all of them by default):
+  load    open a long convo, cold (no index) and warm, in every encoding
+  tools   rounds of many tool calls: sequential, parallel_tools, speculative
+  large   rounds whose tool reads a large file
+  ws      concurrent websocket clients through ws.py and llm.py
+  import  start-up of fresh processes: import, open a convo, make the client
+
+Each scenario prints one JSON line per variant with throughput, p50/p99
+latencies in milliseconds and peak memory.  Everything runs in a scratch
+directory; nothing talks to a real model.
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import resource
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+import mockollama
+
+def _ms(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000, 3)
+
+def report(scenario, variant, latencies, units, elapsed, **extra):
+    result = {
+        'scenario': scenario, 'variant': variant, 'n': len(latencies),
+        'per_s': round(units / elapsed, 1) if elapsed else None,
+        'p50_ms': _ms(latencies, 50), 'p99_ms': _ms(latencies, 99),
+        'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        **extra,
+    }
+    print(json.dumps(result), flush=True)
+    return result
+
+def _convo(filename, header, messages=0, size=200):
+    from convostore import convowriter
+    from convocodec import create
+    create(filename, header)
+    writer = convowriter(filename, 'none')
+    for i in range(messages):
+        role = ('user', 'assistant')[i % 2]
+        writer.write({'role': role, 'content': f'message {i} ' + 'x' * size})
+    writer.close()
+
+def _quiet(hm):
+    hm.display_user = lambda text: None
+    return hm
+
+def load(n=20000):
+    from hallmoot import hallmoot
+    for ext in ('.yml', '.jsonl', '.hmc'):
+        filename = 'load' + ext
+        _convo(filename, {'model': 'mock'}, n)
+        for variant in ('cold', 'warm'):
+            if variant == 'cold' and os.path.exists(filename + '.idx'):
+                os.remove(filename + '.idx')
+            tracemalloc.start()
+            t = time.monotonic()
+            hm = hallmoot(filename)
+            opened = time.monotonic() - t
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            hm.close()
+            report('load', f'{ext} {variant}', [opened], n, opened, messages=n,
+                   peak_kb=peak // 1024, file_kb=os.path.getsize(filename) // 1024)
+        hm = hallmoot(filename)
+        t = time.monotonic()
+        count = sum(1 for _ in hm.messages)
+        elapsed = time.monotonic() - t
+        hm.close()
+        report('load', f'{ext} decode-all', [elapsed], count, elapsed, messages=count)
+
+def _rounds(filename, rounds):
+    from hallmoot import hallmoot
+    hm = _quiet(hallmoot(filename))
+    latencies = []
+    t0 = time.monotonic()
+    for i in range(rounds):
+        hm.messages.append({'role': 'user', 'content': f'round {i}'})
+        t = time.monotonic()
+        while hm.user_round():
+            pass
+        latencies.append(time.monotonic() - t)
+    elapsed = time.monotonic() - t0
+    hm.close()
+    return latencies, elapsed
+
+def tools(rounds=20, calls=8):
+    os.makedirs('sandbox', exist_ok=True)
+    with open('sandbox/big.txt', 'w') as f:
+        f.write('line\n' * 1000)
+    mockollama.script.tool_calls, mockollama.script.tokens = calls, 20
+    for variant, header in (('sequential', {}), ('parallel', {'parallel_tools': True}),
+                            ('speculative', {'speculative': True})):
+        filename = f'tools-{variant}.yml'
+        _convo(filename, {'model': 'mock', **header})
+        latencies, elapsed = _rounds(filename, rounds)
+        report('tools', variant, latencies, rounds * calls, elapsed, calls=calls)
+    mockollama.script.tool_calls = 0
+
+def large(rounds=10, size=5 * 1024 * 1024):
+    os.makedirs('sandbox', exist_ok=True)
+    with open('sandbox/big.txt', 'w') as f:
+        f.write(('y' * 99 + '\n') * (size // 100))
+    mockollama.script.tool_calls, mockollama.script.tokens = 1, 20
+    _convo('large.yml', {'model': 'mock'})
+    latencies, elapsed = _rounds('large.yml', rounds)
+    report('large', f'{size // 1024} KiB file', latencies, rounds, elapsed,
+           convo_kb=os.path.getsize('large.yml') // 1024)
+    mockollama.script.tool_calls = 0
+
+def _wait(proc, port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f'{proc.args[-1]} exited with status {proc.returncode}')
+        try:
+            socket.create_connection(('localhost', port), 0.1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f'{proc.args[-1]} is not listening on {port}')
+
+def ws(clients=20, rounds=3):
+    from wsclient import wsclient
+    os.makedirs('convos', exist_ok=True)
+    shutil.copytree(os.path.join(ROOT, 'static'), 'static', dirs_exist_ok=True)
+    _convo('convos/llm.yml', {'model': 'mock'})
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    procs = [subprocess.Popen([sys.executable, os.path.join(ROOT, 'ws.py')], env=env,
+                              stdout=subprocess.DEVNULL)]
+    _wait(procs[0], 9090)
+    procs.append(subprocess.Popen([sys.executable, os.path.join(ROOT, 'llm.py')], env=env,
+                                  stdout=subprocess.DEVNULL))
+    time.sleep(1)  # until llm.py has subscribed
+    firsts, totals, lock = [], [], threading.Lock()
+    def client():
+        conn = wsclient('ws://localhost:9090/ws')
+        conn.send('hello', '')
+        _, welcome = conn.recv(10)
+        wsid = json.loads(welcome)['id']
+        for i in range(rounds):
+            t = time.monotonic()
+            conn.send('llm.req', json.dumps({'id': wsid, 'content': f'round {i}'}))
+            first = None
+            for _ in conn.stream(wsid, 60):
+                first = first or time.monotonic() - t
+            with lock:
+                firsts.append(first)
+                totals.append(time.monotonic() - t)
+        conn.close()
+    try:
+        t0 = time.monotonic()
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        elapsed = time.monotonic() - t0
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+    # replies that ended without a chunk have no time to first token
+    ttfts = [first for first in firsts if first is not None]
+    report('ws', f'{clients} clients', totals, len(totals), elapsed, empty=len(firsts) - len(ttfts),
+           ttft_p50_ms=_ms(ttfts, 50), ttft_p99_ms=_ms(ttfts, 99))
+
+STARTUP = {
+    'import': 'import hallmoot',
+    'open': 'import hallmoot; hallmoot.hallmoot("start.yml").close()',
+    'client': 'import hallmoot; hallmoot.hallmoot("start.yml").close(); hallmoot._client()',
+}
+
+def startup(runs=20):
+    _convo('start.yml', {'model': 'mock'}, 100)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    for variant, code in STARTUP.items():
+        os.mkdir(variant)
+        shutil.copy('start.yml', variant)
+        latencies = []
+        for _ in range(runs + 1):
+            t = time.monotonic()
+            subprocess.run([sys.executable, '-c', code], cwd=variant, env=env, check=True)
+            latencies.append(time.monotonic() - t)
+        latencies.pop(0)  # writes the .pyc files and the index
+        # importing and opening should leave nothing behind but the index
+        created = sorted(set(os.listdir(variant)) - {'start.yml', 'start.yml.idx'})
+        report('import', variant, latencies, runs, sum(latencies), created=created)
+
+SCENARIOS = {'load': load, 'tools': tools, 'large': large, 'ws': ws, 'import': startup}
+
+def main():
+    names = sys.argv[1:] or list(SCENARIOS)
+    if unknown := [n for n in names if n not in SCENARIOS]:
+        raise SystemExit(f'Unknown scenario {unknown[0]}\n{__doc__}')
+    server = mockollama.serve(0)
+    # before anything imports ollama, whose default client reads it
+    os.environ['OLLAMA_HOST'] = f'http://127.0.0.1:{server.server_address[1]}'
+    os.environ.setdefault('XDG_CACHE_HOME', tempfile.mkdtemp())
+    scratch = tempfile.mkdtemp(prefix='hallmoot-bench-')
+    cwd = os.getcwd()
+    os.chdir(scratch)
+    try:
+        for name in names:
+            SCENARIOS[name]()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+        server.shutdown()
+
+if __name__ == '__main__': main()
@@ -0,0 +1,115 @@
+'''
+Large tool results, kept out of convo files.
+
+With a `blobs` header key, a tool result of MIN_BYTES or more is written to
+a content-addressed store next to the convo (`blobs/` in its directory),
+once however often the same file is read, and the message keeps only a
+preview and the blob's id:
+
+    blobs:
+      min_bytes: 16384   # results this large go to the store
+      preview: 2048      # characters of them kept in the message
+      resolve: turn      # sent in full: 'turn' (since the last user
+                         # message), 'all', or 'none'
+      dir: blobs         # relative to the convo's directory
+
+    role: tool
+    name: read_file
+    blob: 3f0c9a61d2e4b7a8
+    size: 120433
+    content: |-
+      <first 2048 characters>
+      [... 118385 more characters in blob 3f0c9a61d2e4b7a8; read_blob returns them]
+
+When a request is built, blobs of the current turn are put back in full;
+older ones go out as their preview, and the model can fetch them again
+with the read_blob tool.
+'''
+import os
+import re
+import hashlib
+
+DIR = 'blobs'
+MIN_BYTES = 16 * 1024
+PREVIEW = 2048
+READ_MAX = 64 * 1024  # characters read_blob returns at a time
+RESOLVE = ('turn', 'all', 'none')
+KEYS = ('blob', 'size')  # message keys that stay out of requests
+ID = '[0-9a-f]{16}'     # what put() returns; nothing else names a blob
+
+class blobstore:
+    def __init__(self, convo, dir=DIR, min_bytes=MIN_BYTES, preview=PREVIEW, resolve='turn'):
+        if resolve not in RESOLVE:
+            raise ValueError(f"Unknown blob resolve mode {resolve!r}")
+        self.dir = os.path.join(os.path.dirname(convo), dir)
+        self.min_bytes, self.preview, self.resolve = min_bytes, preview, resolve
+    def _path(self, blob):
+        return os.path.join(self.dir, blob[:2], blob)
+    def put(self, text) -> str:
+        '''Store text, unless it is already there, and return its id.'''
+        data = text.encode('utf-8')
+        blob = hashlib.sha256(data).hexdigest()[:16]
+        path = self._path(blob)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return blob
+    def get(self, blob):
+        if not isinstance(blob, str) or not re.fullmatch(ID, blob):
+            return None
+        try:
+            with open(self._path(blob), 'rb') as f:
+                return f.read().decode('utf-8')
+        except OSError:
+            return None
+    def stash(self, message) -> dict:
+        '''The message to keep for a tool result: itself, or a preview and a blob id.'''
+        content = message.get('content')
+        if not isinstance(content, str) or len(content) < self.min_bytes:
+            return message
+        blob = self.put(content)
+        rest = len(content) - self.preview
+        return {**message, 'blob': blob, 'size': len(content),
+                'content': content[:self.preview] +
+                f"\n[... {rest} more characters in blob {blob}; read_blob returns them]"}
+    def view(self, messages) -> list:
+        '''The messages as sent to the model, with the current turn's blobs put back.'''
+        messages = list(messages)
+        turn = max((i for i, m in enumerate(messages) if m.get('role') == 'user'), default=-1)
+        view = []
+        for i, message in enumerate(messages):
+            if blob := message.get('blob'):
+                full = self.resolve == 'all' or (self.resolve == 'turn' and i > turn)
+                message = {k: v for k, v in message.items() if k not in KEYS}
+                # a blob gone missing goes out as its preview
+                if full and (content := self.get(blob)) is not None:
+                    message['content'] = content
+            view.append(message)
+        return view
+    def read_blob(self, blob, start=0, end=None):
+        """
+        Reads a stored tool result that was shortened to a preview.
+
+        Args:
+            blob (str): The blob id given in the shortened result.
+            start (int): Index of the first character to return. Defaults to 0.
+            end (int, optional): Index after the last character to return. Defaults to the end.
+
+        Returns:
+            str: The characters, or an error message. At most 65536 are
+            returned at a time, with a note of where to continue.
+        """
+        if not re.fullmatch(ID, str(blob)):
+            return f"Error: Not a blob id: {blob}"
+        if (text := self.get(str(blob))) is None:
+            return f"Error: No such blob {blob}"
+        end = len(text) if end is None else min(int(end), len(text))
+        start = max(0, int(start))
+        stop = min(end, start + READ_MAX)
+        result = text[start:stop]
+        if stop < end:
+            result += f"\n[truncated at character {stop} of {end}; continue with start={stop}]"
+        return result
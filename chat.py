@@ -2,7 +2,7 @@
 Hallmoot Chat CLI
 
 Usage:
-  chat.py [--url=<url>] [--channels=<channels>] [--file=<file>]
+  chat.py [--url=<url>] [--channels=<channels>] [--file=<file>] [--timeout=<s>]
   chat.py -h | --help
 
 Options:
@@ -10,32 +10,28 @@ Options:
   --url=<url>       WebSocket server URL [default: ws://localhost:9090/ws].
   --channels=<ch>   Comma-separated channels to subscribe to [default: llm].
   --file=<file>     Conversation file for hallmoot [default: convos/chat.yml].
+  --timeout=<s>     Seconds to wait for the next part of a reply [default: 120].
 """
 
 import sys
 import docopt
 import time
-from websocket import create_connection
+from wsclient import wsclient
 
 class ChatClient:
-    def __init__(self, url, channels, convo_file):
-        self.url = f"{url}?channels={channels}"
-        self.ws = create_connection(self.url)
+    def __init__(self, url, channels, convo_file, timeout=120.0):
+        # reconnects and resubscribes by itself (see wsclient)
+        self.ws = wsclient(url, channels.split(','))
         self.convo_file = convo_file
-        print(f"Connected to {self.url}")
+        self.timeout = timeout
+        print(f"Connected to {self.ws.url}")
         print("Type messages. Ctrl+C to exit.")
 
     def send(self, message):
-        self.ws.send("llm")
-        self.ws.send(message)
+        self.ws.send("llm", message)
 
-    def recv(self):
-        try:
-            channel = self.ws.recv()
-            payload = self.ws.recv()
-            return channel, payload
-        except Exception:
-            return None, None
+    def other(self, channel, payload):
+        print(f"[{channel}] {payload}")
 
     def run(self):
         try:
@@ -51,15 +47,12 @@ class ChatClient:
                     break
                 # Send to server
                 self.send(user_input)
-                # Receive responses (streaming)
-                while True:
-                    channel, payload = self.recv()
-                    if channel is None:
-                        break
-                    if channel == 'llm':
-                        print(f"bot> {payload}", end='', flush=True)
-                    else:
-                        print(f"[{channel}] {payload}")
+                # Receive the response as it streams, up to its end marker
+                try:
+                    for payload in self.ws.stream('llm', self.timeout, self.other):
+                        print(payload, end='', flush=True)
+                except TimeoutError:
+                    print(f"\n[no reply for {self.timeout:g}s]", end='')
                 print()  # Newline after response
         except KeyboardInterrupt:
             pass
@@ -72,7 +65,7 @@ def main():
     url = args['--url']
     channels = args['--channels']
     convo_file = args['--file']
-    client = ChatClient(url, channels, convo_file)
+    client = ChatClient(url, channels, convo_file, float(args['--timeout']))
     client.run()
 
 if __name__ == '__main__':
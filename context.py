@@ -0,0 +1,128 @@
+'''
+Context-window management: which messages of a convo are sent to the model.
+
+The whole history stays on disk and in `hallmoot.messages`; only the view
+handed to ollama.chat is trimmed.  Enable it with a `context` header key:
+
+    context:
+      budget: 8192    # estimated tokens sent to the model
+      recent: 8       # most recent messages kept even over budget
+      summarize: 16   # summarize dropped spans of this many messages (or true)
+
+The view is the system messages, then the latest summary of what fell out of
+the window, then as many of the most recent messages as fit the budget.
+The window's start only moves when the budget overflows, and then leaves
+room to grow, so that the prefix sent to the model (and cached by it) stays
+the same for as many rounds as possible.
+Summaries are ordinary system messages with a `summary` key holding the
+number of messages they cover; they are persisted in the convo like any
+other message.
+'''
+BUDGET = 8192
+RECENT = 8
+SUMMARIZE = 16
+TRIM = 0.75  # when the window overflows, refill it to this share of the budget
+
+PROMPT = ('Summarize the conversation below for your own later reference. '
+          'Keep decisions, open tasks, file names and facts you will need; '
+          'drop pleasantries. Reply with the summary only.')
+
+
+def _role(messages, i) -> str:
+    if hasattr(messages, 'role'):
+        return messages.role(i)
+    return messages[i].get('role', '')
+
+def _tokens(messages, i) -> int:
+    if hasattr(messages, 'tokens'):
+        return messages.tokens(i)
+    from convostore import estimate
+    return estimate(messages[i])
+
+def _strip(message) -> dict:
+    return {k: v for k, v in message.items() if k != 'summary'}
+
+
+class contextwindow:
+    def __init__(self, budget=BUDGET, recent=RECENT, summarize=False) -> None:
+        self.budget, self.recent = budget, recent
+        self.summarize = SUMMARIZE if summarize is True else summarize
+        self.start = None  # where the window started last time
+        pass
+    def select(self, messages):
+        '''
+        Return (pinned, summary, start): the indices of the system messages,
+        the index of the summary to include (or None) and the index where
+        the window of recent messages starts.
+        '''
+        n = len(messages)
+        pinned, summaries = [], []
+        for i in range(n):
+            if _role(messages, i) == 'system':
+                if 'summary' in messages[i]:
+                    summaries.append(i)
+                else:
+                    pinned.append(i)
+                    pass
+                pass
+            pass
+        cost = sum(_tokens(messages, i) for i in pinned)
+        if summaries:
+            cost += _tokens(messages, summaries[-1])
+            pass
+        if self.start is not None and self.start <= n:
+            tail = sum(_tokens(messages, i) for i in range(self.start, n)
+                       if _role(messages, i) != 'system')
+            if cost + tail <= self.budget:
+                return pinned, self._summary(messages, summaries, self.start), self.start
+            pass
+        start, kept = n, 0
+        for i in range(n - 1, -1, -1):
+            if _role(messages, i) == 'system':
+                continue
+            t = _tokens(messages, i)
+            if kept >= self.recent and cost + t > self.budget * TRIM:
+                break
+            cost, kept, start = cost + t, kept + 1, i
+            pass
+        # never open the window on tool results cut off from their call
+        while start < n and _role(messages, start) == 'tool':
+            start += 1
+            pass
+        self.start = start
+        return pinned, self._summary(messages, summaries, start), start
+    def _summary(self, messages, summaries, start):
+        summary = None
+        for i in summaries:
+            if messages[i]['summary'] <= start:
+                summary = i
+                pass
+            pass
+        return summary
+    def view(self, messages, summarize=None):
+        '''
+        Return (view, summary): the messages to send, and a new summary
+        message to append to the convo if one was made with summarize(text).
+        '''
+        pinned, summary, start = self.select(messages)
+        covered = messages[summary]['summary'] if summary is not None else 0
+        new = None
+        dropped = [i for i in range(covered, start) if _role(messages, i) != 'system']
+        if summarize and self.summarize and len(dropped) >= self.summarize:
+            lines = [messages[summary]['content']] if summary is not None else []
+            for i in dropped:
+                message = messages[i]
+                lines.append(f"{message['role']}: {message.get('content') or ''}")
+                pass
+            new = {'role': 'system', 'summary': start,
+                   'content': 'Summary of the earlier conversation:\n' + summarize('\n'.join(lines))}
+            pass
+        view = [messages[i] for i in pinned]
+        if new is not None:
+            view.append(_strip(new))
+        elif summary is not None:
+            view.append(_strip(messages[summary]))
+            pass
+        view += [m for i, m in enumerate(messages[start:], start) if _role(messages, i) != 'system']
+        return view, new
+    pass
@@ -0,0 +1,251 @@
+'''
+Encodings of convo files.
+
+A convo file is a sequence of documents, the header first and then one per
+message, in one of three encodings:
+
+    yaml    a YAML stream, each document introduced by `---` (.yml, .yaml)
+    jsonl   one JSON object per line (.jsonl)
+    framed  binary frames of JSON, large ones compressed (.hmc)
+
+A framed file starts with MAGIC; every frame is a FRAME header (stored
+length, decoded length, role, compression) and its payload.  Payloads of
+COMPRESS_MIN bytes or more, typically file dumps and make logs returned by
+tools, are compressed with zstd when it is available (the `zstandard`
+package, or `compression.zstd` from Python 3.14) and zlib otherwise.
+
+The encoding of an existing file is recognized from its first bytes; a new
+file takes the one named by the `codec` header key, or else by its
+extension, or else YAML.  JSON goes through orjson when it is installed.
+
+    hallmoot convert <filename> <new_filename> [<codec>]
+
+rewrites a convo in another encoding and checks that every document reads
+back the same.
+'''
+import os
+import struct
+
+ROLES = ('', 'system', 'user', 'assistant', 'tool')
+EXTENSIONS = {'.yml': 'yaml', '.yaml': 'yaml', '.jsonl': 'jsonl', '.hmc': 'framed'}
+
+MAGIC = b'HMCONV1\n'
+FRAME = struct.Struct('<IIBB')  # stored length, decoded length, role, compression
+COMPRESS_MIN = 4096
+NONE, ZLIB, ZSTD = 0, 1, 2
+
+def _role(message) -> int:
+    role = message.get('role', '') if isinstance(message, dict) else ''
+    return ROLES.index(role) if role in ROLES else 0
+
+_json = None
+
+def _json_codec():
+    '''(loads, dumps) for JSON bytes: orjson's when it is installed.'''
+    global _json
+    if _json is None:
+        try:
+            import orjson
+            _json = orjson.loads, lambda obj: orjson.dumps(
+                obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+        except ImportError:
+            import json
+            _json = json.loads, lambda obj: json.dumps(
+                obj, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+    return _json
+
+_zstd = False
+
+def _zstd_codec():
+    '''(compress, decompress) for zstd, or None when it is not installed.'''
+    global _zstd
+    if _zstd is False:
+        try:
+            from compression import zstd
+            _zstd = zstd.compress, zstd.decompress
+        except ImportError:
+            try:
+                import zstandard
+                _zstd = zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress
+            except ImportError:
+                _zstd = None
+    return _zstd
+
+
+class yamlcodec:
+    name = 'yaml'
+    def load(self, data) -> dict:
+        import yaml
+        # libyaml when it is available, the pure Python loader otherwise
+        return yaml.load(data, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+    def dump(self, message) -> bytes:
+        import yaml
+        Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+        return b'---\n' + yaml.dump(message, Dumper=Dumper).encode('utf-8')
+    def start(self, header) -> bytes:
+        import yaml
+        return yaml.safe_dump(header).encode('utf-8')
+    def resumes(self, f, offset) -> bool:
+        '''Whether a document still starts at offset.'''
+        f.seek(offset)
+        return offset == 0 or f.read(3) == b'---'
+    def scan(self, f, pos):
+        '''Yield (offset, length, role, size) for every document from pos on.'''
+        f.seek(pos)
+        start, role, seen = pos, 0, False
+        for line in f:
+            if line.startswith(b'---') and line[3:4] in (b'', b'\n', b'\r', b' '):
+                if seen:
+                    yield start, pos - start, role, pos - start
+                start, role, seen = pos, 0, False
+            elif line.strip():
+                seen = True
+                if line.startswith(b'role: '):
+                    value = line[6:].strip().decode('utf-8', 'replace')
+                    role = ROLES.index(value) if value in ROLES else 0
+            pos += len(line)
+        if seen:
+            yield start, pos - start, role, pos - start
+
+
+class jsonlcodec:
+    name = 'jsonl'
+    def load(self, data) -> dict:
+        return _json_codec()[0](data)
+    def dump(self, message) -> bytes:
+        if isinstance(message, dict) and 'role' in message:
+            # role first, so that scan can read it without decoding
+            message = {'role': message['role'], **message}
+        return _json_codec()[1](message) + b'\n'
+    def start(self, header) -> bytes:
+        return self.dump(header)
+    def resumes(self, f, offset) -> bool:
+        if offset == 0:
+            return True
+        f.seek(offset - 1)
+        return f.read(2) == b'\n{'
+    def scan(self, f, pos):
+        f.seek(pos)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break  # a line still being written
+            if line.strip():
+                if line.startswith(b'{"role":"'):
+                    value = line[9:line.index(b'"', 9)].decode('utf-8', 'replace')
+                    role = ROLES.index(value) if value in ROLES else 0
+                else:
+                    role = _role(self.load(line))
+                yield pos, len(line), role, len(line)
+            pos += len(line)
+
+
+class framedcodec:
+    name = 'framed'
+    def load(self, data) -> dict:
+        length, size, _, compression = FRAME.unpack_from(data)
+        payload = data[FRAME.size:FRAME.size + length]
+        if compression == ZLIB:
+            import zlib
+            payload = zlib.decompress(payload)
+        elif compression == ZSTD:
+            if (zstd := _zstd_codec()) is None:
+                raise ValueError("Convo has zstd frames; install zstandard to read it")
+            payload = zstd[1](payload)
+        return _json_codec()[0](payload)
+    def dump(self, message) -> bytes:
+        payload = _json_codec()[1](message)
+        size, compression = len(payload), NONE
+        if size >= COMPRESS_MIN:
+            if (zstd := _zstd_codec()) is not None:
+                payload, compression = zstd[0](payload), ZSTD
+            else:
+                import zlib
+                payload, compression = zlib.compress(payload), ZLIB
+        return FRAME.pack(len(payload), size, _role(message), compression) + payload
+    def start(self, header) -> bytes:
+        return MAGIC + self.dump(header)
+    def resumes(self, f, offset) -> bool:
+        f.seek(offset)
+        head = f.read(FRAME.size)
+        return (len(head) == FRAME.size and head[-2] < len(ROLES) and head[-1] <= ZSTD)
+    def scan(self, f, pos):
+        if pos == 0:
+            f.seek(0)
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("Not a framed convo file")
+            pos = len(MAGIC)
+        f.seek(pos)
+        end = os.fstat(f.fileno()).st_size
+        while len(head := f.read(FRAME.size)) == FRAME.size:
+            length, size, role, _ = FRAME.unpack(head)
+            if pos + FRAME.size + length > end:
+                break  # a frame still being written
+            f.seek(length, os.SEEK_CUR)
+            yield pos, FRAME.size + length, role, size
+            pos += FRAME.size + length
+
+
+CODECS = {c.name: c for c in (yamlcodec(), jsonlcodec(), framedcodec())}
+
+_known = {}  # abspath -> codec, for files whose encoding has been sniffed
+
+def named(name):
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec {name!r}")
+    return CODECS[name]
+
+def for_file(filename, name=None):
+    '''The codec of filename: from its content, else name, its extension or YAML.'''
+    path = os.path.abspath(filename)
+    if (codec := _known.get(path)) is not None:
+        return codec
+    try:
+        with open(path, 'rb') as f:
+            start = f.read(len(MAGIC))
+    except OSError:
+        start = b''
+    if start:
+        codec = CODECS['framed' if start == MAGIC else 'jsonl' if start[:1] == b'{' else 'yaml']
+        _known[path] = codec
+        return codec
+    return named(name or EXTENSIONS.get(os.path.splitext(filename)[1], 'yaml'))
+
+def create(filename, header, name=None):
+    '''Start a new convo file with header (failing if it exists).'''
+    codec = for_file(filename, name or header.get('codec'))
+    with open(filename, 'xb') as f:
+        f.write(codec.start(header))
+    return codec
+
+def convert(src, dst, name=None) -> int:
+    '''
+    Write the documents of convo src to the new file dst in another
+    encoding, read them back, and return how many there were.
+    '''
+    from convostore import convostore, convowriter
+    source = for_file(src)
+    with open(src, 'rb') as f:
+        docs = []
+        for offset, length, _, _ in convostore(src).records():
+            f.seek(offset)
+            docs.append(source.load(f.read(length)))
+    if not docs:
+        raise ValueError(f"{src} is empty")
+    header = dict(docs[0])
+    target = named(name) if name else for_file(dst)
+    if 'codec' in header:
+        header['codec'] = target.name
+    create(dst, header, target.name)
+    writer = convowriter(dst, 'fsync')
+    for doc in docs[1:]:
+        writer.write(doc)
+    writer.close()
+    records = convostore(dst).records()
+    if len(records) != len(docs):
+        raise ValueError(f"{dst} has {len(records)} documents, {src} has {len(docs)}")
+    with open(dst, 'rb') as f:
+        for i, (offset, length, _, _) in enumerate(records):
+            f.seek(offset)
+            if target.load(f.read(length)) != (header if i == 0 else docs[i]):
+                raise ValueError(f"Document {i} of {dst} does not match {src}")
+    return len(docs)
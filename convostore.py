@@ -0,0 +1,313 @@
+'''
+Indexed access to convo files.
+
+A convo file is a header document followed by one document per message, as
+a YAML stream, JSON lines or compressed frames (see convocodec).  The convo
+file stays the source of truth; next to it we keep a sidecar index
+(`<filename>.idx`) with the byte offset, length, role and decoded size of
+every document, so a convo can be opened by decoding the header and the
+last few messages only.  Older messages are decoded on demand.
+
+The index is brought up to date incrementally whenever the convo file has
+grown since it was written, and rebuilt from scratch if the file was
+rewritten.
+
+Messages are appended through a `convowriter`, which holds the file open and
+buffers serialized documents until a round boundary or a size/time threshold.
+How hard a flush pushes data to disk is set by the `durability` header key:
+
+    none    leave it to the OS and Python's file buffer
+    flush   hand it to the OS at every flush (the default)
+    fsync   flush and fsync
+
+A branch is a convo whose header names a parent convo and a byte length:
+
+    branch: convos/parent.yml
+    length: 1234
+
+It continues from the first `length` bytes of the parent (whose header it
+inherits, save for keys it sets itself) and appends only its own messages.
+Parsed prefixes are shared between branches through a cache keyed by
+(path, length, mtime), and the parent may itself be a branch.
+'''
+import os
+import time
+import struct
+from convocodec import ROLES, for_file
+from collections import OrderedDict
+from collections.abc import MutableSequence
+
+EAGER = 32  # messages decoded when a convo is opened, counted from the end
+
+MAGIC = b'HMIDX2\n'
+HEAD = struct.Struct('<QQ')      # indexed bytes, mtime_ns of the convo file
+RECORD = struct.Struct('<QIBI')  # offset, length, role, decoded size
+
+DURABILITY = ('none', 'flush', 'fsync')
+FLUSH_BYTES = 64 * 1024  # flush early once this much is buffered
+FLUSH_INTERVAL = 1.0     # ... or once the oldest buffered message is this old
+PREFIXES = 64            # parsed branch prefixes kept in memory
+
+
+class ref:
+    '''A message that has not been decoded yet.'''
+    __slots__ = ('path', 'offset', 'length', 'role', 'size', 'value')
+    def __init__(self, path, offset, length, role, size) -> None:
+        self.path, self.offset, self.length = path, offset, length
+        self.role, self.size, self.value = ROLES[role], size, None
+        pass
+    def get(self) -> dict:
+        if self.value is None:
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                self.value = for_file(self.path).load(f.read(self.length))
+                pass
+            pass
+        return self.value
+    pass
+
+
+def _resolve(items) -> None:
+    '''Decode every pending ref in items, opening each file once.'''
+    pending = {}
+    for item in items:
+        if isinstance(item, ref) and item.value is None:
+            pending.setdefault(item.path, []).append(item)
+            pass
+        pass
+    for path, refs in pending.items():
+        load = for_file(path).load
+        with open(path, 'rb') as f:
+            for r in sorted(refs, key=lambda r: r.offset):
+                f.seek(r.offset)
+                r.value = load(f.read(r.length))
+                pass
+            pass
+        pass
+    pass
+
+
+def estimate(message) -> int:
+    '''A rough token count for a message: about four characters a token.'''
+    if isinstance(message, ref):
+        return message.size // 4 + 4
+    size = len(str(message.get('content') or ''))
+    if calls := message.get('tool_calls'):
+        size += len(str(calls))
+        pass
+    return size // 4 + 4
+
+
+class lazymessages(MutableSequence):
+    '''A list of messages where entries may still live on disk.'''
+    def __init__(self, items=()) -> None:
+        self._items = list(items)
+        self._tokens = [None] * len(self._items)
+        pass
+    def __len__(self) -> int:
+        return len(self._items)
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            items = self._items[i]
+            _resolve(items)
+            return [x.value if isinstance(x, ref) else x for x in items]
+        x = self._items[i]
+        return x.get() if isinstance(x, ref) else x
+    def __setitem__(self, i, value) -> None:
+        if isinstance(i, slice):
+            value = list(value)
+            self._items[i] = value
+            self._tokens[i] = [None] * len(value)
+        else:
+            self._items[i] = value
+            self._tokens[i] = None
+            pass
+        pass
+    def __delitem__(self, i) -> None:
+        del self._items[i]
+        del self._tokens[i]
+    def insert(self, i, value) -> None:
+        self._items.insert(i, value)
+        self._tokens.insert(i, None)
+    def __iter__(self):
+        _resolve(self._items)
+        for x in self._items:
+            yield x.value if isinstance(x, ref) else x
+            pass
+        pass
+    def __repr__(self) -> str:
+        return repr(list(self))
+    def role(self, i) -> str:
+        '''The role of message i, without decoding it.'''
+        x = self._items[i]
+        return x.role if isinstance(x, ref) else x.get('role', '')
+    def tokens(self, i) -> int:
+        '''Estimated tokens of message i, without decoding it.'''
+        if (n := self._tokens[i]) is None:
+            n = self._tokens[i] = estimate(self._items[i])
+            pass
+        return n
+
+
+class convostore:
+    def __init__(self, filename) -> None:
+        self.filename = filename
+        self.index_name = filename + '.idx'
+        pass
+    def _read_index(self):
+        try:
+            with open(self.index_name, 'rb') as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    return 0, 0, []
+                size, mtime = HEAD.unpack(f.read(HEAD.size))
+                data = f.read()
+        except (OSError, struct.error):
+            return 0, 0, []
+        n = len(data) // RECORD.size
+        return size, mtime, [RECORD.unpack_from(data, i * RECORD.size) for i in range(n)]
+    def _write_index(self, size, mtime, records, keep) -> None:
+        '''Write records[keep:] after the first keep records on disk.'''
+        try:
+            mode = 'r+b' if keep else 'wb'
+            with open(self.index_name, mode) as f:
+                if not keep:
+                    f.write(MAGIC)
+                    pass
+                f.seek(len(MAGIC))
+                f.write(HEAD.pack(size, mtime))
+                f.seek(len(MAGIC) + HEAD.size + keep * RECORD.size)
+                f.truncate()
+                f.write(b''.join(RECORD.pack(*r) for r in records[keep:]))
+                pass
+            pass
+        except OSError:
+            pass  # read-only location: the index just lives in memory
+        pass
+    def records(self) -> list:
+        '''Return (offset, length, role, size) for every document, header first.'''
+        st = os.stat(self.filename)
+        size, mtime, records = self._read_index()
+        if records and size == st.st_size and mtime == st.st_mtime_ns:
+            return records
+        codec = for_file(self.filename)
+        with open(self.filename, 'rb') as f:
+            keep = 0
+            if records and size < st.st_size:
+                # appended to since we last looked: rescan from the last
+                # document on, provided it still starts where we left it
+                if codec.resumes(f, records[-1][0]):
+                    keep = len(records) - 1
+                    pass
+                pass
+            start = records[keep][0] if keep else 0
+            records = records[:keep] + list(codec.scan(f, start))
+            pass
+        self._write_index(st.st_size, st.st_mtime_ns, records, keep)
+        return records
+    def load(self, eager=EAGER):
+        '''Return the header and a lazymessages list for the convo.'''
+        records = self.records()
+        if not records:
+            return None, lazymessages()
+        header, items = _assemble(self.filename, records)
+        _resolve(items[-eager:] if eager else [])
+        return dict(header), lazymessages(items)
+    pass
+
+
+_prefixes = OrderedDict()
+
+def _assemble(path, records):
+    '''Header and message refs for records of path, following branches.'''
+    items = [ref(path, *r) for r in records]
+    header = items.pop(0).get()
+    if 'branch' in header and 'length' in header:
+        base, prefix = load_prefix(header['branch'], header['length'])
+        header = {**base, **{k: v for k, v in header.items() if k not in ('branch', 'length')}}
+        items = prefix + items
+    elif 'branch' in header and 'length' not in header:
+        raise ValueError("Branch file specified but no length")
+    elif 'branch' not in header and 'length' in header:
+        raise ValueError("Length specified but no branch file")
+    return header, items
+
+def load_prefix(path, length):
+    '''Header and message refs for the first length bytes of convo path.'''
+    key = (os.path.abspath(path), length, os.stat(path).st_mtime_ns)
+    if key in _prefixes:
+        _prefixes.move_to_end(key)
+    else:
+        records = [r for r in convostore(path).records() if r[0] + r[1] <= length]
+        if not records:
+            raise ValueError(f"Branch point {length} is inside the header of {path}")
+        _prefixes[key] = _assemble(path, records)
+        if len(_prefixes) > PREFIXES:
+            _prefixes.popitem(last=False)
+            pass
+        pass
+    header, items = _prefixes[key]
+    return header, list(items)
+
+def branch_point(path, n):
+    '''Return (parent, length) such that the branch continues after n messages of path.'''
+    records = convostore(path).records()
+    header = ref(path, *records[0]).get()
+    if 'branch' in header:
+        # messages inherited from the parent come first
+        inherited = len(load_prefix(header['branch'], header['length'])[1])
+        if n <= inherited:
+            return branch_point(header['branch'], n)
+        n -= inherited
+        pass
+    if n >= len(records):
+        raise ValueError(f"{path} has fewer than {n} messages")
+    offset, length = records[n][:2]
+    return path, offset + length
+
+
+class convowriter:
+    def __init__(self, filename, durability='flush',
+                 flush_bytes=FLUSH_BYTES, flush_interval=FLUSH_INTERVAL) -> None:
+        if durability not in DURABILITY:
+            raise ValueError(f"Unknown durability {durability!r}")
+        self.filename = filename
+        self.codec = for_file(filename)
+        self.durability = durability
+        self.flush_bytes, self.flush_interval = flush_bytes, flush_interval
+        self.file, self.pending, self.size, self.since = None, [], 0, None
+        pass
+    def write(self, message) -> None:
+        data = self.codec.dump(message)
+        self.pending.append(data)
+        self.size += len(data)
+        if self.since is None:
+            self.since = time.monotonic()
+            pass
+        if (self.size >= self.flush_bytes or
+            time.monotonic() - self.since >= self.flush_interval):
+            self.flush()
+            pass
+        pass
+    def flush(self) -> None:
+        if self.pending:
+            if self.file is None:
+                self.file = open(self.filename, 'ab')
+                pass
+            self.file.write(b''.join(self.pending))
+            self.pending, self.size, self.since = [], 0, None
+            pass
+        if self.file is None or self.durability == 'none':
+            return
+        self.file.flush()
+        if self.durability == 'fsync':
+            os.fsync(self.file.fileno())
+            pass
+        pass
+    def close(self) -> None:
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            pass
+        pass
+    pass
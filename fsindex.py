@@ -0,0 +1,139 @@
+'''
+An incrementally refreshed index of the files under a directory.
+
+list_files is called constantly, and walking and stat-ing a sandbox that
+holds a node_modules or a build tree takes seconds.  The index keeps every
+directory's listing together with the directory's mtime.  Listings are
+revalidated (one stat per directory, rescanning only those whose mtime
+changed) at most every REFRESH seconds, or sooner once invalidate() has
+been called; callers that change the tree themselves invalidate the
+directories they touched.  Files are stat-ed only when their details are
+asked for.
+
+Paths matching the root's .gitignore (and .git itself) can be left out, in
+which case ignored directories are not descended into at all.  Patterns
+follow gitignore: a leading or inner slash anchors one to the root, a
+trailing one limits it to directories, and !pattern re-includes what an
+earlier pattern left out (but not below an ignored directory).
+'''
+import os
+import time
+import threading
+from fnmatch import fnmatch
+
+REFRESH = 2.0  # seconds between revalidations of the cached listings
+
+def _parse_ignore(text):
+    '''(pattern, negated, dir_only, anchored) for each line of a .gitignore.'''
+    patterns = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        negated = line.startswith('!')
+        line = line[1:] if negated else line
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        # a slash at the start or in the middle ties the pattern to the root
+        anchored = '/' in line
+        line = line.lstrip('/')
+        if line:
+            patterns.append((line, negated, dir_only, anchored))
+    return patterns
+
+class fsindex:
+    def __init__(self, root, refresh=REFRESH):
+        self.root, self.refresh = root, refresh
+        self.dirs = {}  # relative dir -> (mtime_ns, subdirs, files)
+        self.checked, self.dirty = 0.0, True
+        self.ignore, self.ignore_key = [], None
+        self.lock = threading.Lock()
+    def invalidate(self, path=None):
+        '''Forget the listing of path (relative to root), or revalidate all.'''
+        with self.lock:
+            if path is None:
+                self.dirty = True
+                return
+            path = os.path.normpath(path)
+            while True:
+                # a new directory changes the listings of its ancestors too
+                self.dirs.pop(path, None)
+                if path in ('.', '', os.sep):
+                    break
+                path = os.path.dirname(path) or '.'
+    def _ignored(self, rel, is_dir):
+        name = os.path.basename(rel)
+        if name == '.git':
+            return True
+        ignored = False
+        # the last pattern that matches decides, so a later !pattern re-includes
+        for pattern, negated, dir_only, anchored in self.ignore:
+            if dir_only and not is_dir:
+                continue
+            if fnmatch(rel if anchored else name, pattern):
+                ignored = not negated
+        return ignored
+    def _load_ignore(self):
+        path = os.path.join(self.root, '.gitignore')
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.ignore, self.ignore_key = [], None
+            return
+        if self.ignore_key != (st.st_mtime_ns, st.st_size):
+            with open(path, errors='replace') as f:
+                self.ignore = _parse_ignore(f.read())
+            self.ignore_key = (st.st_mtime_ns, st.st_size)
+    def _listing(self, rel, validate):
+        cached = self.dirs.get(rel)
+        if cached is not None and not validate:
+            return cached
+        full = os.path.join(self.root, rel)
+        try:
+            mtime = os.stat(full).st_mtime_ns
+        except OSError:
+            self.dirs.pop(rel, None)
+            return None
+        if cached is not None and cached[0] == mtime:
+            return cached
+        dirs, files = [], []
+        with os.scandir(full) as entries:
+            for entry in entries:
+                (dirs if entry.is_dir(follow_symlinks=False) else files).append(entry.name)
+        self.dirs[rel] = listing = (mtime, sorted(dirs), sorted(files))
+        return listing
+    def walk(self, top='.', max_depth=None, gitignore=False, pattern=None, relative_to=None):
+        '''
+        Paths under top (relative to root, or to relative_to), files before
+        subdirectories at each level, like os.walk.
+        '''
+        with self.lock:
+            now = time.monotonic()
+            validate = self.dirty or now - self.checked >= self.refresh
+            if validate:
+                self.dirty, self.checked = False, now
+                self._load_ignore()
+            top = os.path.normpath(top)
+            if self._listing(top, validate) is None:
+                raise FileNotFoundError(f"No such directory: {top}")
+            result, stack = [], [(top, 1)]
+            while stack:
+                rel, depth = stack.pop()
+                if (listing := self._listing(rel, validate)) is None:
+                    continue
+                _, dirs, files = listing
+                subdirs = []
+                for names, is_dir in ((files, False), (dirs, True)):
+                    for name in names:
+                        path = os.path.normpath(os.path.join(rel, name))
+                        if gitignore and self._ignored(path, is_dir):
+                            continue
+                        if is_dir:
+                            subdirs.append(path)
+                        if pattern is None or fnmatch(path, pattern) or fnmatch(name, pattern):
+                            result.append(path)
+                if max_depth is None or depth < max_depth:
+                    stack.extend((d, depth + 1) for d in reversed(subdirs))
+        if relative_to is not None:
+            result = [os.path.relpath(p, relative_to) for p in result]
+        return result
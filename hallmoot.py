@@ -1,21 +1,52 @@
 '''
 Usage: hallmoot <filename>
+       hallmoot fork <filename> [<at_message>] [<branch_filename>]
+       hallmoot convert <filename> <new_filename> [<codec>]
+       hallmoot batch <pattern> [options]   (see batch.py)
 '''
 
 # -- tools -- #
 import os
 
 SANDBOX = 'sandbox'
-os.makedirs(SANDBOX, exist_ok=True)
+
+_made = None
+
+def _sandbox():
+    # created on first use, so that importing this module touches nothing
+    global _made
+    if _made != SANDBOX:
+        os.makedirs(SANDBOX, exist_ok=True)
+        _made = SANDBOX
+    return SANDBOX
 
 def _sanitize_path(path):
     # Resolve absolute path and ensure it's within sandbox
+    _sandbox()
     abs_path = os.path.abspath(os.path.join(SANDBOX, path))
     if not abs_path.startswith(os.path.abspath(SANDBOX)):
         raise ValueError("Path outside sandbox")
     return abs_path
 
-def list_files(directory=".", recursive=False, details=False):
+LIST_LIMIT = 1000  # entries list_files returns per page
+
+_index = None
+
+def _fsindex():
+    global _index
+    if _index is None or _index.root != SANDBOX:
+        from fsindex import fsindex
+        _index = fsindex(_sandbox())
+    return _index
+
+def _changed(safe_path=None):
+    # tell the file index what changed: a path, or anything (None)
+    if _index is not None:
+        _index.invalidate(None if safe_path is None else
+                          os.path.relpath(os.path.dirname(safe_path), os.path.abspath(SANDBOX)))
+
+def list_files(directory=".", recursive=False, details=False, pattern=None,
+               max_depth=None, offset=0, limit=LIST_LIMIT, gitignore=False):
     """
     Lists files in the specified directory within the sandbox.
 
@@ -23,62 +54,180 @@ def list_files(directory=".", recursive=False, details=False):
         directory (str): The directory to list files from. Defaults to the current directory.
         recursive (bool): Whether to list files recursively. Defaults to False.
         details (bool): Whether to include file details (size, mtime). Defaults to False.
+        pattern (str, optional): Glob pattern the path or name must match, e.g. '*.py'.
+        max_depth (int, optional): How many directory levels to descend when recursive.
+        offset (int): Index of the first entry to return, for paging. Defaults to 0.
+        limit (int): Most entries to return. Defaults to 1000.
+        gitignore (bool): Whether to leave out .git and paths ignored by the sandbox's .gitignore. Defaults to False.
 
     Returns:
-        str: JSON string of file list or details.
+        str: JSON string of file list or details, or of an object with the
+        page in "items" and "next_offset" when there are more entries.
     """
     try:
         safe_dir = _sanitize_path(directory)
         import json
+        top = os.path.relpath(safe_dir, os.path.abspath(SANDBOX))
         if recursive:
-            result = []
-            for root, dirs, files in os.walk(safe_dir):
-                for name in files + dirs:
-                    full_path = os.path.join(root, name)
-                    rel_path = os.path.relpath(full_path, SANDBOX)
-                    if details:
-                        stat = os.stat(full_path)
-                        result.append({'path': rel_path, 'size': stat.st_size, 'mtime': stat.st_mtime})
-                    else:
-                        result.append(rel_path)
-            return json.dumps(result)
+            # paths relative to the sandbox
+            items = _fsindex().walk(top, max_depth, gitignore, pattern)
+            base = SANDBOX
         else:
-            items = os.listdir(safe_dir)
-            if details:
-                result = []
-                for name in items:
-                    full_path = os.path.join(safe_dir, name)
-                    stat = os.stat(full_path)
-                    result.append({'path': name, 'size': stat.st_size, 'mtime': stat.st_mtime})
-                return json.dumps(result)
-            else:
-                return json.dumps(items)
+            # names within the directory
+            items = _fsindex().walk(top, 1, gitignore, pattern, relative_to=top)
+            base = safe_dir
+        page = items[offset:offset + limit]
+        if details:
+            result = []
+            for name in page:
+                stat = os.stat(os.path.join(base, name))
+                result.append({'path': name, 'size': stat.st_size, 'mtime': stat.st_mtime})
+            page = result
+        if offset + limit < len(items):
+            return json.dumps({'items': page, 'next_offset': offset + limit, 'total': len(items)})
+        return json.dumps(page)
     except Exception as e:
         return f"Error: {e}"
 
-def read_file(filepath, start=None, end=None):
+MAX_READ = 64 * 1024    # bytes a read tool returns before handing back a cursor
+MMAP_MIN = 1024 * 1024  # files at least this large are read through mmap
+
+def _map(path):
+    """The bytes of a file: mmapped when it is large, read in full otherwise."""
+    import mmap
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_MIN:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return f.read()
+
+def _line_offset(buf, line):
+    # byte offset where 1-based line starts
+    pos = 0
+    for _ in range(max(line, 1) - 1):
+        if (pos := buf.find(b'\n', pos) + 1) == 0:
+            return len(buf)
+    return pos
+
+def _capped(buf, start, end):
+    # decode buf[start:end], at most MAX_READ bytes of it, noting where to go on
+    stop = min(end, start + MAX_READ)
+    while start < stop < end and (buf[stop] & 0xC0) == 0x80:
+        stop -= 1  # don't split a UTF-8 sequence
+    text = bytes(buf[start:stop]).decode('utf-8', 'replace')
+    if stop < end:
+        text += f"\n[truncated at byte {stop} of {end}; continue with start={stop}]"
+    return text
+
+def read_file(filepath, start=None, end=None, start_line=None, end_line=None):
     """
-    Reads the content of a file within the sandbox.
+    Reads the content of a file within the sandbox, or a range of it.
+
+    At most 64 KiB are returned at a time; a longer result ends with a note
+    giving the start offset to continue from.
 
     Args:
         filepath (str): The path to the file to read.
         start (int, optional): Byte offset to start reading.
         end (int, optional): Byte offset to end reading.
+        start_line (int, optional): First line to read, counting from 1.
+        end_line (int, optional): Last line to read (inclusive).
 
     Returns:
         str: The content of the file or a slice.
     """
     try:
         safe_path = _sanitize_path(filepath)
-        with open(safe_path, 'r') as file:
-            if start is not None or end is not None:
-                file.seek(start or 0)
-                return file.read((end or file.size()) - (start or 0))
-            return file.read()
+        buf = _map(safe_path)
+        try:
+            first = start or 0
+            last = len(buf) if end is None else min(end, len(buf))
+            if start_line is not None:
+                first = max(first, _line_offset(buf, start_line))
+            if end_line is not None:
+                last = min(last, _line_offset(buf, end_line + 1))
+            return _capped(buf, first, max(first, last))
+        finally:
+            if not isinstance(buf, bytes):
+                buf.close()
+    except Exception as e:
+        return f"Error: {e}"
+
+def head_file(filepath, lines=10):
+    """
+    Returns the first lines of a file within the sandbox.
+
+    Args:
+        filepath (str): The path to the file to read.
+        lines (int): How many lines to return. Defaults to 10.
+
+    Returns:
+        str: The first lines of the file.
+    """
+    return read_file(filepath, start_line=1, end_line=lines)
+
+def tail_file(filepath, lines=10):
+    """
+    Returns the last lines of a file within the sandbox.
+
+    Args:
+        filepath (str): The path to the file to read.
+        lines (int): How many lines to return. Defaults to 10.
+
+    Returns:
+        str: The last lines of the file.
+    """
+    try:
+        safe_path = _sanitize_path(filepath)
+        buf = _map(safe_path)
+        try:
+            pos = len(buf)
+            if pos and buf[pos - 1:pos] == b'\n':
+                pos -= 1  # the final newline does not start a line
+            for _ in range(lines):
+                if (pos := buf.rfind(b'\n', 0, pos)) < 0:
+                    break
+            first = pos + 1 if pos >= 0 else 0
+            return _capped(buf, first, len(buf))
+        finally:
+            if not isinstance(buf, bytes):
+                buf.close()
     except Exception as e:
         return f"Error: {e}"
 
-def write_file(filepath, content, append=False):
+def grep_file(pattern, filepath, ignore_case=False, start_line=1, max_matches=100):
+    """
+    Searches a file within the sandbox for lines matching a regular expression.
+
+    Args:
+        pattern (str): The regular expression to search for.
+        filepath (str): The path to the file to search.
+        ignore_case (bool): Whether to ignore case. Defaults to False.
+        start_line (int): Line to start searching from, counting from 1. Defaults to 1.
+        max_matches (int): Most matching lines to return. Defaults to 100.
+
+    Returns:
+        str: Matching lines prefixed with their line numbers.
+    """
+    try:
+        import re
+        regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+        safe_path = _sanitize_path(filepath)
+        result, size = [], 0
+        with open(safe_path, 'r', errors='replace') as file:
+            for lineno, line in enumerate(file, 1):
+                if lineno < start_line or not regex.search(line):
+                    continue
+                if len(result) >= max_matches or size >= MAX_READ:
+                    result.append(f"[more matches; continue with start_line={lineno}]")
+                    break
+                result.append(f"{lineno}:{line.rstrip(chr(10))}")
+                size += len(result[-1])
+        return '\n'.join(result)
+    except Exception as e:
+        return f"Error: {e}"
+
+def write_file(filepath, content, append=False, offset=None):
     """
     Writes content to a file within the sandbox.
 
@@ -86,6 +235,7 @@ def write_file(filepath, content, append=False):
         filepath (str): The path to the file to write to.
         content (str): The content to write to the file.
         append (bool): Whether to append to the file. Defaults to False.
+        offset (int, optional): Byte offset to overwrite from, keeping the rest of the file.
 
     Returns:
         str: A success message or an error message.
@@ -93,9 +243,17 @@ def write_file(filepath, content, append=False):
     try:
         safe_path = _sanitize_path(filepath)
         os.makedirs(os.path.dirname(safe_path), exist_ok=True)
+        if offset is not None:
+            mode = 'r+b' if os.path.exists(safe_path) else 'wb'
+            with open(safe_path, mode) as file:
+                file.seek(offset)
+                file.write(content.encode('utf-8'))
+            _changed(safe_path)
+            return "File written successfully."
         mode = 'a' if append else 'w'
         with open(safe_path, mode) as file:
             file.write(content)
+        _changed(safe_path)
         return "File written successfully."
     except Exception as e:
         return f"Error: {e}"
@@ -113,6 +271,7 @@ def mkdir(path):
     try:
         safe_path = _sanitize_path(path)
         os.makedirs(safe_path, exist_ok=True)
+        _changed(os.path.join(safe_path, '.'))
         return "Directory created successfully."
     except Exception as e:
         return f"Error: {e}"
@@ -130,94 +289,380 @@ def rm_file(filepath):
     try:
         safe_path = _sanitize_path(filepath)
         os.remove(safe_path)
+        _changed(safe_path)
         return "File removed successfully."
     except Exception as e:
         return f"Error: {e}"
 
-def run_make(target='all', directory=None):
+MAKE_TIMEOUT = 600  # seconds before a build is killed
+
+def run_make(target='all', directory=None, jobs=1, timeout=MAKE_TIMEOUT):
     """
     Runs make in the sandbox or a subdirectory within it.
 
     Args:
         target (str): The make target to run. Defaults to 'all'.
         directory (str, optional): Subdirectory within sandbox to run make in.
+        jobs (int): How many jobs make may run in parallel (make -j). Defaults to 1.
+        timeout (int): Seconds after which the build is stopped. Defaults to 600.
 
     Returns:
-        str: The output of make or an error message.
+        str: The output of make (stdout and stderr) and its exit status, or an error message.
     """
     try:
-        import subprocess
-        cwd = _sanitize_path(directory) if directory else SANDBOX
-        result = subprocess.run(['make', '-C', cwd, target], capture_output=True, text=True)
-        return result.stdout or result.stderr
+        import time
+        from procpool import run, deadline
+        cwd = _sanitize_path(directory) if directory else _sandbox()
+        if (end := deadline.get()) is not None:
+            timeout = round(min(timeout, max(0.0, end - time.monotonic())), 1)
+            pass
+        argv = ['make', '-C', cwd, target] + ([f'-j{jobs}'] if jobs > 1 else [])
+        status, output = run(argv, timeout=timeout, jobs=jobs)
+        _changed()
+        if status is None:
+            return output + f"\n[make timed out after {timeout}s and was stopped]"
+        return output + f"\n[make exited with status {status}]"
     except Exception as e:
         return f"Error: {e}"
 
+# Tool calls in one assistant turn may run concurrently when the convo header
+# sets `parallel_tools` (true, or a number of workers).  A toolkit module
+# configures this with the constants below; tools named in SERIAL have side
+# effects and are never overlapped with any other call.
+EXECUTOR = 'thread'  # or 'process'
+MAX_WORKERS = 4
+SERIAL = {'write_file', 'mkdir', 'rm_file', 'run_make'}
+# Tools whose result depends only on their arguments and on the files named
+# by the listed arguments (relative to SANDBOX); these may be served from
+# the response cache (see respcache).  list_files is not one: a recursive or
+# detailed listing changes with files below the directory it names.
+CACHEABLE = {'read_file': ('filepath',), 'head_file': ('filepath',),
+             'tail_file': ('filepath',), 'grep_file': ('filepath',)}
+# Tools without side effects; with the speculative header key they start as
+# soon as the model has named them, while the rest of the round streams.
+READONLY = {'list_files', 'read_file', 'head_file', 'tail_file', 'grep_file'}
+
             
 # -- main -- #
 
 __version__ = '1.0.1'
 
+# header keys handed to ollama.chat; everything else configures hallmoot
+CHAT_ARGS = ('model', 'messages', 'tools', 'format', 'options', 'keep_alive', 'think')
+# how long ollama keeps the model (and its prompt cache) loaded between rounds
+KEEP_ALIVE = '30m'
+# header keys configuring how messages are persisted (see convostore);
+# `codec` picks the encoding of new files (see convocodec)
+WRITER_ARGS = ('durability', 'flush_bytes', 'flush_interval')
+
+_sync_client = None
+
+def _client():
+    '''The ollama.Client, and its pool of HTTP connections, shared by every convo.'''
+    global _sync_client
+    if _sync_client is None:
+        import ollama
+        _sync_client = ollama.Client()
+        pass
+    return _sync_client
+
+_async_clients = None
+
+def _async_client():
+    '''The ollama.AsyncClient shared by every convo on the running loop.'''
+    global _async_clients
+    import asyncio, weakref
+    if _async_clients is None:
+        _async_clients = weakref.WeakKeyDictionary()
+        pass
+    loop = asyncio.get_running_loop()
+    if (client := _async_clients.get(loop)) is None:
+        import ollama
+        client = _async_clients[loop] = ollama.AsyncClient()
+        pass
+    return client
+
+class coalescer:
+    '''
+    Batches display chunks (often single tokens) so that display_user sees
+    one write per window seconds or max_bytes of text, whichever is first.
+    Given a sink, push() writes to it itself, and a timer writes out text
+    that has waited a whole window with nothing after it (a pause in the
+    stream, or tool calls, which are not displayed).
+    '''
+    def __init__(self, window=0.03, max_bytes=4096) -> None:
+        import threading
+        self.window, self.max_bytes = window, max_bytes
+        self.parts, self.size, self.since = [], 0, None
+        self.timer = None
+        self.lock = threading.RLock()  # the timer flushes from its own thread
+        pass
+    def push(self, text, sink=None):
+        '''
+        Buffer text; once it is due, write everything buffered to sink, or
+        without one return it (else None).
+        '''
+        import time
+        with self.lock:
+            now = time.monotonic()
+            if self.since is None:
+                self.since = now
+                if sink is not None:
+                    self._arm(sink)
+                    pass
+                pass
+            self.parts.append(text)
+            self.size += len(text)
+            if self.size < self.max_bytes and now - self.since < self.window:
+                return None
+            text = self.drain()
+            if sink is None:
+                return text
+            sink(text)
+            pass
+        return None
+    def _arm(self, sink) -> None:
+        import threading
+        self.timer = threading.Timer(self.window, self._expire, (sink,))
+        self.timer.daemon = True
+        self.timer.start()
+        pass
+    def _expire(self, sink) -> None:
+        with self.lock:
+            if text := self.drain():
+                sink(text)
+                pass
+            pass
+        pass
+    def drain(self):
+        '''Return everything buffered, or None if there is nothing.'''
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+                pass
+            text = ''.join(self.parts) or None
+            self.parts, self.size, self.since = [], 0, None
+            return text
+    pass
+
+def _call(tool, tool_args):
+    try:
+        return tool(**tool_args)
+    except Exception as e:
+        return f"Error: {e}"
+
+def _timed_call(tool, tool_args):
+    import time
+    t = time.monotonic()
+    return _call(tool, tool_args), time.monotonic() - t
+
 class hallmoot:
     def __init__(self, filename) -> None:
         self.filename = filename
         self._load_convo()
+        # the blobs header key moves large tool results out of the convo
+        # (see blobstore); it also adds the read_blob tool
+        if (args := self.convo.get('blobs', None)) is not None:
+            from blobstore import blobstore
+            self.blobs = blobstore(filename, **(args if isinstance(args, dict) else {}))
+        else:
+            self.blobs = None
+            pass
         self._load_tools()
+        self._open_writer()
+        from metrics import metrics
+        self.metrics = metrics(filename, self.convo.get('metrics', None))
+        # set the coalesce header key (true, or window/max_bytes) to batch
+        # display chunks; callers may also assign a coalescer directly
+        if args := self.convo.get('coalesce', None):
+            self.coalesce = coalescer(**(args if isinstance(args, dict) else {}))
+        else:
+            self.coalesce = None
+            pass
+        # the cache header key serves repeated rounds and tool calls from disk
+        if (args := self.convo.get('cache', None)) is not None:
+            from respcache import respcache
+            self.cache = respcache(**(args if isinstance(args, dict) else {}))
+        else:
+            self.cache = None
+            pass
+        # the context header key trims what is sent to the model
+        if (args := self.convo.get('context', None)) is not None:
+            from context import contextwindow
+            self.context = contextwindow(**(args if isinstance(args, dict) else {}))
+        else:
+            self.context = None
+            pass
+        # the backends header key spreads rounds over several hosts
+        if (args := self.convo.get('backends', None)) is not None:
+            from router import configure
+            self.router = configure(args)
+        else:
+            self.router = None
+            pass
+        # a time.monotonic() by which rounds must end, for callers running
+        # convos unattended (see batch); None for no limit
+        self.deadline = None
+        self._timed_client = None  # our own client, for requests within it
+        pass
+    def close(self) -> None:
+        self.writer.close()
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+            pass
+        if self._timed_client is not None:
+            self._timed_client.close()
+            self._timed_client = None
+            pass
         pass
     def display_user(self, text) -> None:
         import sys
         return sys.stderr.write(text)
+    def _display(self, text) -> None:
+        if self.coalesce is None:
+            self.display_user(text)
+        else:
+            self.coalesce.push(text, self.display_user)
+            pass
+        pass
+    def _display_flush(self) -> None:
+        if self.coalesce is not None and (text := self.coalesce.drain()):
+            self.display_user(text)
+            pass
+        pass
     @property
     def messages(self) -> list:
         return self.convo['messages']
     def _load_convo(self) -> None:
-        import yaml
-        # Load base config
-        with open(self.filename, 'r') as f:
-            config = yaml.safe_load(f)
+        from convostore import convostore
+        # Load base config, plus the tail of the convo through its index;
+        # branches pull in their parent's prefix (see convostore)
+        config, messages = convostore(self.filename).load()
         if not config:
             raise ValueError("Invalid convo file")
-        # Handle branching
-        if 'branch' in config and 'length' in config:
-            branch_file = config['branch']
-            max_bytes = config['length']
-            with open(branch_file, 'r') as f:
-                chunk = f.read(max_bytes)
-            messages = list(yaml.safe_load_all(chunk))
-        elif 'branch' in config and 'length' not in config:
-            raise ValueError("Branch file specified but no length")
-        elif 'branch' not in config and 'length' in config:
-            raise ValueError("Length specified but no branch file")
-        else:
-            # Normal load
-            with open(self.filename) as f:
-                messages = list(yaml.safe_load_all(f))
-                pass
-            pass
-        self.convo = messages.pop(0)
+        self.convo = config
         self.convo['messages'] = messages
         pass
+    def fork(self, at_message=None, filename=None) -> str:
+        '''
+        Start a branch of this convo after its first at_message messages
+        (all of them by default) and return the branch's filename.
+        '''
+        from convostore import branch_point
+        from convocodec import create, for_file
+        self.writer.flush()
+        n = len(self.messages) if at_message is None else at_message
+        parent, length = branch_point(self.filename, n)
+        if filename is None:
+            root, ext = os.path.splitext(self.filename)
+            i = 0
+            while os.path.exists(filename := f'{root}.{n}.{i}{ext}'):
+                i += 1
+                pass
+            pass
+        # in the convo's own encoding, unless its header names another
+        create(filename, {'branch': parent, 'length': length},
+               self.convo.get('codec') or for_file(self.filename).name)
+        return filename
     def _load_tools(self) -> None:
+        import sys
+        self.pool = None
         if toolkit := self.convo.get('tools', None):
             from importlib import import_module
             mod = import_module(toolkit, __package__)
             self.tools = dict((k, v) for k, v in vars(mod).items() if callable(v))
         else:
+            mod = sys.modules[__name__]
             self.tools = {
                 'list_files': list_files,
                 'read_file': read_file,
+                'head_file': head_file,
+                'tail_file': tail_file,
+                'grep_file': grep_file,
                 'write_file': write_file,
                 'mkdir': mkdir,
                 'rm_file': rm_file,
                 'run_make': run_make,
             }
             pass
-        self.convo['tools'] = list(self.tools.values())
+        self.readonly = set(getattr(mod, 'READONLY', ()))
+        if self.blobs is not None:
+            self.tools['read_blob'] = self.blobs.read_blob
+            self.readonly.add('read_blob')
+            pass
+        # schemas built once per toolkit (see toolschema), in a stable order
+        # that keeps this prefix of every request byte-identical
+        from toolschema import schemas
+        self.convo['tools'] = schemas(self.tools)
+        self.serial = set(getattr(mod, 'SERIAL', ()))
+        self.executor = getattr(mod, 'EXECUTOR', EXECUTOR)
+        self.cacheable = getattr(mod, 'CACHEABLE', {})
+        self.tool_root = getattr(mod, 'SANDBOX', '.')
+        self.max_workers = getattr(mod, 'MAX_WORKERS', MAX_WORKERS)
+    def _tool_pool(self, required=False):
+        if not (workers := self.convo.get('parallel_tools', False)) and not required:
+            return None
+        if self.pool is None:
+            from concurrent import futures
+            workers = workers if workers and workers is not True else self.max_workers
+            if self.executor == 'process':
+                self.pool = futures.ProcessPoolExecutor(workers)
+            else:
+                self.pool = futures.ThreadPoolExecutor(workers)
+                pass
+            pass
+        return self.pool
+    def _open_writer(self) -> None:
+        from convostore import convowriter
+        args = {k: v for k, v in self.convo.items() if k in WRITER_ARGS}
+        self.writer = convowriter(self.filename, **args)
+        pass
+    def _chat_args(self) -> dict:
+        args = {k: v for k, v in self.convo.items() if k in CHAT_ARGS}
+        args['messages'] = self._view()
+        args.setdefault('keep_alive', KEEP_ALIVE)
+        return args
+    def _round_stats(self, response) -> None:
+        '''Keep the timings ollama reports in the final chunk of a round.'''
+        keys = ('prompt_eval_count', 'prompt_eval_duration', 'eval_count',
+                'eval_duration', 'load_duration', 'total_duration')
+        self.round_stats = {k: getattr(response, k, None) for k in keys}
+        if self.convo.get('report', False):
+            import sys
+            s = self.round_stats
+            ms = lambda ns: (ns or 0) / 1e6
+            sys.stderr.write(f"[prompt {s['prompt_eval_count']} tok {ms(s['prompt_eval_duration']):.0f} ms, "
+                             f"eval {s['eval_count']} tok {ms(s['eval_duration']):.0f} ms]\n")
+            pass
+        pass
+    def _view(self) -> list:
+        '''The messages sent to the model: all of them, or a context window.'''
+        # blobs are put back first, so that the window is measured on what
+        # is actually sent (blobs.view keeps every message at its index)
+        messages = self.messages if self.blobs is None else self.blobs.view(self.messages)
+        if self.context is None:
+            return messages
+        view, summary = self.context.view(messages, self._summarize)
+        if summary is not None:
+            self.messages.append(summary)
+            self._persist_message(summary)
+            pass
+        return view
+    def _summarize(self, text) -> str:
+        from context import PROMPT
+        messages = [{'role': 'system', 'content': PROMPT}, {'role': 'user', 'content': text}]
+        return self._chat(model=self.convo['model'], messages=messages).message.content
     def _persist_message(self, message) -> None:
-        import yaml
-        with open(self.filename, 'a') as f:
-            f.write('---\n')
-            yaml.dump(message, f)
+        with self.metrics.span('persist'):
+            self.writer.write(message)
+            pass
+        pass
+    def _flush(self) -> None:
+        with self.metrics.span('persist'):
+            self.writer.flush()
+            pass
         pass
     def user_input(self) -> None:
         while 1:
@@ -228,71 +673,347 @@ class hallmoot:
                 if ret.startswith('/m'):
                     print(self.messages)
                     continue
+                if ret.startswith('/s'):
+                    import json
+                    stats = self.metrics.summary()
+                    if self.router is not None:
+                        stats['backends'] = self.router.stats()
+                        pass
+                    print(json.dumps(stats, indent=2))
+                    continue
                 message = {'role': 'user', 'content': ret}
                 self.messages.append(message)
                 self._persist_message(message)
                 return
             pass
         pass
+    def _tool_key(self, tool_name, tool_args):
+        if self.cache is None or tool_name not in self.cacheable:
+            return None
+        paths = [os.path.join(self.tool_root, str(tool_args.get(arg, '.')))
+                 for arg in self.cacheable[tool_name]]
+        return self.cache.tool_key(tool_name, tool_args, paths)
     def run_tool(self, tool_name, tool_args) -> None:
+        if self._expired():
+            return f"Error: No time left to run {tool_name}"
         if tool := self.tools.get(tool_name, None):
-            try:
-                return tool(**tool_args)
-            except Exception as e:
-                return f"Error: {e}"
+            if key := self._tool_key(tool_name, tool_args):
+                if (result := self.cache.tool_get(key)) is not None:
+                    return result
+                pass
+            result, seconds = _timed_call(tool, tool_args)
+            self.metrics.add(f'tool:{tool_name}', seconds)
+            if key:
+                self.cache.tool_put(key, result)
+                pass
+            return result
         else:
             return f"Error: Unknown tool {tool_name}"
+    def _speculate(self, started, i, tool_call) -> None:
+        '''
+        Start tool call i while the model is still streaming, if it and
+        every call before it are read-only (and so were started too).
+        '''
+        name, args = tool_call.function.name, tool_call.function.arguments
+        if len(started) != i or name not in self.readonly or name not in self.tools:
+            return
+        if (key := self._tool_key(name, args)) and (hit := self.cache.tool_get(key)) is not None:
+            from concurrent import futures
+            f = futures.Future()
+            f.set_result((hit, 0.0))
+            started[i] = None, name, f
+            return
+        import contextvars
+        pool, tool = self._tool_pool(required=True), self.tools[name]
+        if self.executor == 'process':
+            started[i] = key, name, pool.submit(_timed_call, tool, args)
+        else:
+            context = contextvars.copy_context()
+            started[i] = key, name, pool.submit(context.run, _timed_call, tool, args)
+            pass
+        self.metrics.count('speculated')
+        pass
+    def run_tools(self, tool_calls, started=None) -> list:
+        '''
+        Run tool calls, concurrently where allowed; results in call order.
+        started holds calls already running (see _speculate) by index.
+        '''
+        from procpool import output, deadline
+        # subprocesses started by tools stream their output to the user
+        token = output.set(self._display)
+        limit = deadline.set(self.deadline)
+        try:
+            return self._run_tools(tool_calls, started or {})
+        finally:
+            deadline.reset(limit)
+            output.reset(token)
+            self._display_flush()
+            pass
+        pass
+    def _run_tools(self, tool_calls, started) -> list:
+        import contextvars
+        results = [None] * len(tool_calls)
+        if len(tool_calls) - len(started) < 2 or (pool := self._tool_pool()) is None:
+            # started calls come before any call that is not read-only
+            self._collect(started, results)
+            for i, tc in enumerate(tool_calls):
+                if i not in started:
+                    results[i] = self.run_tool(tc.function.name, tc.function.arguments)
+                    pass
+                pass
+            return results
+        running = dict(started)
+        for i, tc in enumerate(tool_calls):
+            name, args = tc.function.name, tc.function.arguments
+            if i in started:
+                continue
+            elif (tool := self.tools.get(name, None)) is None or name in self.serial or self._expired():
+                # wait for everything before it, then run it on its own
+                self._collect(running, results)
+                running = {}
+                results[i] = self.run_tool(name, args)
+            elif (key := self._tool_key(name, args)) and (hit := self.cache.tool_get(key)) is not None:
+                results[i] = hit
+            else:
+                if self.executor == 'process':
+                    running[i] = key, name, pool.submit(_timed_call, tool, args)
+                else:
+                    context = contextvars.copy_context()
+                    running[i] = key, name, pool.submit(context.run, _timed_call, tool, args)
+                    pass
+                pass
+            pass
+        self._collect(running, results)
+        return results
+    def _collect(self, running, results) -> None:
+        for j, (key, name, f) in running.items():
+            results[j], seconds = f.result()
+            self.metrics.add(f'tool:{name}', seconds)
+            if key:
+                self.cache.tool_put(key, results[j])
+                pass
+            pass
+        pass
+    def _expired(self) -> bool:
+        import time
+        return self.deadline is not None and time.monotonic() >= self.deadline
+    def _check_deadline(self) -> None:
+        if self._expired():
+            raise TimeoutError("The convo ran past its deadline")
+        pass
+    def _backend(self):
+        '''Where model requests go: the router (see router), or the shared client.'''
+        return _client() if self.router is None else self.router
+    def _chat(self, **args):
+        '''A model request, ending with a timeout error at the deadline if there is one.'''
+        if self.deadline is None:
+            return self._backend().chat(**args)
+        import time
+        left = self.deadline - time.monotonic()
+        if self.router is not None:
+            return self.router.chat(**args, timeout=left)
+        # the shared client's timeout is not ours to set: one client of our
+        # own for the convo, kept until close()
+        from router import timed
+        if self._timed_client is None:
+            import ollama
+            self._timed_client = ollama.Client()
+            pass
+        return timed(self._timed_client, left).chat(**args)
+    def _stream(self):
+        '''The chunks of a model round, from ollama or the response cache.'''
+        self._check_deadline()
+        args = self._chat_args()
+        call = lambda: self._chat(**args, stream=True)
+        return call() if self.cache is None else self.cache.chat(args, call)
     def user_round(self) -> bool:
-        import ollama
         contents, tool_calls = [], []
-        for response in ollama.chat(**self.convo, stream=True):
+        response = None
+        started = {} if self.convo.get('speculative', False) else None
+        self.metrics.start_round()
+        with self.metrics.span('model'):
+            for response in self._stream():
+                self._chunk_metrics()
+                self._check_deadline()
+                message = response.message
+                if message.content:
+                    if not contents:
+                        self._display("asst> ")
+                        pass
+                    contents.append(message.content)
+                    self._display(message.content)
+                    pass
+                for tool_call in message.tool_calls or []:
+                    tool_calls.append(tool_call)
+                    if started is not None:
+                        self._speculate(started, len(tool_calls) - 1, tool_call)
+                        pass
+                    pass
+                pass
+            else:
+                self._display('<<\n')
+                self._display_flush()
+                pass
+        self._round_stats(response)
+        self._commit_assistant(contents, tool_calls)
+        if tool_calls:
+            self.metrics.count('tool_calls', len(tool_calls))
+            self._commit_tools(tool_calls, self.run_tools(tool_calls, started))
+            pass
+        self._flush()
+        self.metrics.end_round(self.round_stats)
+        return bool(tool_calls)
+    def _chunk_metrics(self) -> None:
+        self.metrics.mark('ttft')
+        self.metrics.count('chunks')
+        pass
+    def _commit_assistant(self, contents, tool_calls) -> None:
+        # exactly what the model produced, so the next request's prefix
+        # matches what it has cached
+        message = {'role': 'assistant', 'content': ''.join(contents)}
+        if tool_calls:
+            message['tool_calls'] = [{'function': {'name': tc.function.name, 'arguments': tc.function.arguments}} for tc in tool_calls]
+            pass
+        self.messages.append(message)
+        self._persist_message(message)
+        pass
+    def _commit_tools(self, tool_calls, results) -> None:
+        for tc, result in zip(tool_calls, results):
+            tool_msg = {'role': 'tool', 'name': tc.function.name, 'content': result}
+            if self.blobs is not None:
+                tool_msg = self.blobs.stash(tool_msg)
+                pass
+            self.messages.append(tool_msg)
+            self._persist_message(tool_msg)
+            pass
+        pass
+    async def _astream(self):
+        '''The chunks of a model round for astream_round, from where _stream gets them.'''
+        if self.router is None and self.cache is None and self.deadline is None:
+            async for response in await _async_client().chat(**self._chat_args(), stream=True):
+                yield response
+                pass
+            return
+        # the router and the cache are synchronous: step through _stream in
+        # worker threads, one chunk at a time
+        import asyncio
+        loop = asyncio.get_running_loop()
+        end = object()
+        chunks = await loop.run_in_executor(None, self._stream)
+        try:
+            while (response := await loop.run_in_executor(None, next, chunks, end)) is not end:
+                yield response
+                pass
+        finally:
+            if hasattr(chunks, 'close'):
+                await loop.run_in_executor(None, chunks.close)
+                pass
+            pass
+        pass
+    async def astream_round(self):
+        '''
+        Async user_round: yields display chunks instead of calling
+        display_user, and leaves what user_round would return in self.more.
+        '''
+        import asyncio, time
+        contents, tool_calls, chunks = [], [], []
+        response = None
+        running = {} if self.convo.get('speculative', False) else None
+        self.metrics.start_round()
+        started = self.metrics.started
+        async for response in self._astream():
+            self._chunk_metrics()
+            self._check_deadline()
             message = response.message
             if message.content:
                 if not contents:
-                    self.display_user("asst> ")
+                    chunks.append("asst> ")
                     pass
                 contents.append(message.content)
-                self.display_user(message.content)
+                chunks.append(message.content)
                 pass
             for tool_call in message.tool_calls or []:
                 tool_calls.append(tool_call)
+                if running is not None:
+                    self._speculate(running, len(tool_calls) - 1, tool_call)
+                    pass
                 pass
+            for text in chunks:
+                if self.coalesce is None:
+                    yield text
+                elif text := self.coalesce.push(text):
+                    yield text
+                    pass
+                pass
+            chunks.clear()
             pass
+        self.metrics.add('model', time.monotonic() - started)
+        self._round_stats(response)
+        if self.coalesce is not None and (text := self.coalesce.drain()):
+            yield text + '<<\n'
         else:
-            self.display_user('<<\n')
+            yield '<<\n'
             pass
-        if not tool_calls:
-            message = {'role': 'assistant', 'content': '\n'.join(contents)}
-            self.messages.append(message)
-            self._persist_message(message)
-            return False
-        else:
-            message = {'role': 'assistant', 'content': '\n'.join(contents), 'tool_calls': [{'function': {'name': tc.function.name, 'arguments': tc.function.arguments}} for tc in tool_calls]}
-            self.messages.append(message)
-            self._persist_message(message)
-            for tc in tool_calls:
-                results = self.run_tool(tc.function.name, tc.function.arguments)
-                tool_msg = {'role': 'tool', 'name': tc.function.name, 'content': results}
-                self.messages.append(tool_msg)
-                self._persist_message(tool_msg)
+        self._commit_assistant(contents, tool_calls)
+        if tool_calls:
+            loop = asyncio.get_running_loop()
+            self.metrics.count('tool_calls', len(tool_calls))
+            results = await loop.run_in_executor(None, self.run_tools, tool_calls, running)
+            self._commit_tools(tool_calls, results)
+            pass
+        self._flush()
+        self.metrics.end_round(self.round_stats)
+        self.more = bool(tool_calls)
+        pass
+    async def achat(self, content):
+        '''Add a user message and yield display chunks until the model is done.'''
+        message = {'role': 'user', 'content': content}
+        self.messages.append(message)
+        self._persist_message(message)
+        self.more = True
+        while self.more:
+            async for text in self.astream_round():
+                yield text
                 pass
-            return True
+            pass
         pass
     pass
 
 
 def main():
     import sys
+    if sys.argv[1:2] == ['fork']:
+        if len(sys.argv) < 3:
+            raise SystemExit(__doc__)
+        at = int(sys.argv[3]) if len(sys.argv) > 3 else None
+        print(hallmoot(sys.argv[2]).fork(at, *sys.argv[4:5]))
+        return
+    if sys.argv[1:2] == ['batch']:
+        from batch import main
+        return main(sys.argv[1:])
+    if sys.argv[1:2] == ['convert']:
+        if len(sys.argv) < 4:
+            raise SystemExit(__doc__)
+        from convocodec import convert
+        n = convert(*sys.argv[2:5])
+        print(f'{sys.argv[3]}: {n} documents, {os.path.getsize(sys.argv[3])} bytes '
+              f'({os.path.getsize(sys.argv[2])} before)')
+        return
     try:
         filename = sys.argv[1]
     except:
         filename = 'convos/u.yml'        
     convo = hallmoot(filename)
-    while 1:
-        convo.user_input()
-        while convo.user_round():
+    try:
+        while 1:
+            convo.user_input()
+            while convo.user_round():
+                pass
             pass
         pass
+    finally:
+        convo.close()
+        pass
     pass
 
 
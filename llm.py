@@ -1,50 +1,144 @@
 #!/usr/bin/env python3
-from gevent import monkey as _;_.patch_all()
-from websocket import create_connection
+# patch only when run as a server; importing this module changes nothing
+if __name__ == '__main__': from gevent import monkey as _;_.patch_all()
+import gevent
+from gevent.lock import Semaphore
+from collections import OrderedDict
+from wsclient import wsclient
+import wire
+import json
+import os
+import re
 import sys
+import time
 sys.path.append('.')
-from hallmoot import hallmoot
+from hallmoot import hallmoot, coalescer
+
+CONVOS = 'convos'
+TEMPLATE = 'convos/llm.yml'  # shared convo; its header seeds new sessions
+MAX_SESSIONS = 64            # conversations kept in memory
+IDLE = 600                   # seconds before an idle session is evicted
+HEXID = re.compile('[0-9a-f]+')  # client ids as assigned by ws.py
+REQUESTS = 'llm.req'         # private requests; only we subscribe to it
+WINDOW = 0.03                # seconds of streamed tokens per published message
+
+class session:
+    def __init__(self, hm):
+        self.hm = hm
+        self.lock = Semaphore()  # one round at a time per conversation
+        self.used = time.monotonic()
+
+class sessions:
+    '''Open conversations keyed by client id, least recently used first.'''
+    def __init__(self, max_sessions=MAX_SESSIONS, idle=IDLE):
+        self.data = OrderedDict()
+        self.max_sessions, self.idle = max_sessions, idle
+    def filename(self, key):
+        if key == 'llm':
+            return TEMPLATE
+        # in the encoding of the shared convo (see convocodec)
+        return os.path.join(CONVOS, key + os.path.splitext(TEMPLATE)[1])
+    def open(self, key):
+        filename = self.filename(key)
+        if not os.path.exists(filename):
+            # a new client: start from the header of the shared convo
+            from convostore import convostore
+            offset, length = convostore(TEMPLATE).records()[0][:2]
+            with open(TEMPLATE, 'rb') as src, open(filename, 'xb') as dst:
+                # from the start of the file, so any leading magic comes along
+                dst.write(src.read(offset + length))
+        hm = hallmoot(filename)
+        if hm.coalesce is None:
+            hm.coalesce = coalescer(WINDOW)
+        return hm
+    def get(self, key):
+        if key in self.data:
+            self.data.move_to_end(key)
+        else:
+            self.data[key] = session(self.open(key))
+            self.evict(keep=key)
+        s = self.data[key]
+        s.used = time.monotonic()
+        return s
+    def evict(self, keep=None):
+        now = time.monotonic()
+        for key, s in list(self.data.items()):
+            if len(self.data) <= self.max_sessions and now - s.used < self.idle:
+                break
+            if s.lock.locked() or key == keep:
+                continue  # mid-round, or about to be; try again later
+            del self.data[key]
+            s.hm.close()
+    def reap(self):
+        while True:
+            gevent.sleep(self.idle / 4)
+            self.evict()
 
 class WS:
-    URL = "ws://localhost:9090/ws?channels=llm,one,two,hello"
+    URL = "ws://localhost:9090/ws"
+    CHANNELS = ('llm', REQUESTS, 'one', 'two', 'hello')
     CH = 'llm'
-    def __init__(self, url=URL):
-        self.url = url
-        self.ws = create_connection(url)
-        self.hm = hallmoot('convos/llm.yml')
-        # Override display_user to stream over WebSocket
-        self.hm.display_user = self.stream_output
+    def __init__(self, url=URL, channels=CHANNELS):
+        # reconnects and resubscribes by itself (see wsclient)
+        self.ws = wsclient(url, channels)
+        self.sessions = sessions()
+        # every round's metrics go out on the stats channel
+        import metrics
+        metrics.HOOKS.append(lambda record: self.pub(json.dumps(record), channel='stats'))
     def pub(self, message, channel=CH):
-        self.ws.send(channel)
-        self.ws.send(message)
-        return
+        return self.ws.send(channel, message)
     def recv2(self):
-        c = self.ws.recv()
-        p = self.ws.recv()
-        return c,p
+        return self.ws.recv()
     def close(self):
         return self.ws.close()
-    def stream_output(self, text):
-        # Stream assistant output over WebSocket
-        self.pub(text, channel='llm')
     def handle_llm(self, payload):
-        # Append user message and run a round
-        message = {'role': 'user', 'content': payload}
-        self.hm.messages.append(message)
-        self.hm._persist_message(message)
-        # Run round (streaming via overridden display_user)
-        more = True
-        while more:
-            more = self.hm.user_round()
-        # No need to return content; it's streamed
+        # text on the llm channel goes to the shared conversation, which
+        # every llm subscriber sees
+        gevent.spawn(self.run, 'llm', 'llm', payload)
+    def handle_request(self, payload):
+        # {"id": <wsid>, "content": ...} on REQUESTS talks to that client's
+        # own conversation and streams back on its wsid channel, so no
+        # other client sees either side of it
+        try:
+            request = json.loads(payload)
+        except ValueError:
+            return
+        if not isinstance(request, dict) or not HEXID.fullmatch(str(request.get('id', ''))):
+            return
+        gevent.spawn(self.run, request['id'], request['id'], request.get('content', ''))
+    def run(self, key, channel, content):
+        try:
+            s = self.sessions.get(key)
+            with s.lock:
+                # Stream assistant output over WebSocket
+                s.hm.display_user = lambda text: self.pub(text, channel=channel)
+                message = {'role': 'user', 'content': content}
+                s.hm.messages.append(message)
+                s.hm._persist_message(message)
+                # Run rounds (streaming via overridden display_user)
+                try:
+                    more = True
+                    while more:
+                        more = s.hm.user_round()
+                finally:
+                    s.used = time.monotonic()
+        finally:
+            # tell the client the reply is over, even if it failed
+            self.pub(wire.EOS, channel=channel)
     pass
 
-ws = WS()
-ws.pub("zone", "hello")
-while True:
-    channel, payload = ws.recv2()
-    print(211,channel,payload)
-    if channel=='llm':
-        ws.handle_llm(payload)
-    pass
-ws.close()
+def main():
+    ws = WS()
+    gevent.spawn(ws.sessions.reap)
+    ws.pub("zone", "hello")
+    while True:
+        channel, payload = ws.recv2()
+        print(211,channel,payload)
+        if channel=='llm':
+            ws.handle_llm(payload)
+        elif channel==REQUESTS:
+            ws.handle_request(payload)
+        pass
+    ws.close()
+
+if __name__ == '__main__': main()
@@ -0,0 +1,88 @@
+'''
+Per-round timings and counters for hallmoot.
+
+Each round yields one record:
+
+    {"time": ..., "convo": "convos/u.yml", "total": 2.31, "ttft": 0.42,
+     "spans": {"model": 1.9, "tool:read_file": 0.01, "persist": 0.002},
+     "counters": {"tool_calls": 1, "chunks": 57},
+     "prompt_eval_count": 812, "prompt_eval_duration": 0.35,
+     "eval_count": 54, "eval_duration": 1.41}
+
+Durations are in seconds.  Records are appended to a JSONL file when the
+convo header names one (`metrics: metrics.jsonl`), passed to the callables
+in HOOKS (every convo) and `metrics.hooks` (one convo), and summarized by
+summary() for `/stats`.
+'''
+import json
+import time
+from contextlib import contextmanager
+
+HOOKS = []    # called with every round record of every convo
+KEEP = 1000   # round totals kept for percentiles
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+class metrics:
+    def __init__(self, convo, path=None):
+        self.convo, self.path = convo, path
+        self.hooks = []
+        self.record = None
+        self.rounds = 0
+        self.totals = {}        # span or counter -> sum over all rounds
+        self.history = {}       # 'total', 'ttft' -> recent values
+    def start_round(self):
+        self.started = time.monotonic()
+        self.record = {'time': time.time(), 'convo': self.convo, 'spans': {}, 'counters': {}}
+    @contextmanager
+    def span(self, name):
+        t = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - t)
+    def add(self, name, seconds):
+        if self.record is not None:
+            spans = self.record['spans']
+            spans[name] = spans.get(name, 0.0) + seconds
+    def count(self, name, n=1):
+        if self.record is not None:
+            counters = self.record['counters']
+            counters[name] = counters.get(name, 0) + n
+    def mark(self, name):
+        '''Note the time since the round started, once (e.g. ttft).'''
+        if self.record is not None and name not in self.record:
+            self.record[name] = time.monotonic() - self.started
+    def end_round(self, stats=None):
+        if (record := self.record) is None:
+            return None
+        self.record = None
+        record['total'] = time.monotonic() - self.started
+        for k, v in (stats or {}).items():
+            if v is not None:
+                # ollama reports durations in nanoseconds
+                record[k] = v / 1e9 if k.endswith('_duration') else v
+        self.rounds += 1
+        for name, value in list(record['spans'].items()) + list(record['counters'].items()):
+            self.totals[name] = self.totals.get(name, 0) + value
+        for k in ('total', 'ttft'):
+            if k in record:
+                values = self.history.setdefault(k, [])
+                values.append(record[k])
+                del values[:-KEEP]
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        for hook in HOOKS + self.hooks:
+            hook(record)
+        return record
+    def summary(self):
+        result = {'rounds': self.rounds, 'totals': self.totals}
+        for k, values in self.history.items():
+            result[k] = {'p50': _percentile(values, 50), 'p99': _percentile(values, 99),
+                         'max': max(values)}
+        return result
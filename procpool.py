@@ -0,0 +1,113 @@
+'''
+Running subprocesses on behalf of tools.
+
+run() starts a command with its stdout and stderr merged, streams the
+output as it arrives to whatever callable the caller has put in the
+`output` context variable (hallmoot sets it to its display), keeps at most
+MAX_OUTPUT bytes of it (the beginning and the end), and kills the whole
+process group once TIMEOUT seconds have passed.  Callers with a time limit
+of their own put it in the `deadline` context variable, a time.monotonic()
+that tools keep their commands' timeouts within.
+
+Every command holds slots from a process-wide pool of SLOTS while it runs,
+one per job it may spawn (`make -j4` takes four), so concurrent sessions in
+one process cannot start more work than the host has CPUs for.
+'''
+import os
+import time
+import signal
+import codecs
+import selectors
+import threading
+import contextvars
+import subprocess
+
+TIMEOUT = 600
+MAX_OUTPUT = 64 * 1024
+SLOTS = int(os.environ.get('HALLMOOT_SLOTS', 0)) or os.cpu_count() or 1
+
+output = contextvars.ContextVar('output', default=None)
+deadline = contextvars.ContextVar('deadline', default=None)
+
+class slots:
+    '''A counting semaphore whose holders can take several slots at once.'''
+    def __init__(self, n):
+        self.free = self.size = n
+        self.cond = threading.Condition()
+    def acquire(self, n):
+        n = max(1, min(n, self.size))
+        with self.cond:
+            self.cond.wait_for(lambda: self.free >= n)
+            self.free -= n
+        return n
+    def release(self, n):
+        with self.cond:
+            self.free += n
+            self.cond.notify_all()
+
+_slots = slots(SLOTS)
+
+def _kill(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(2)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.wait()
+
+def run(argv, cwd=None, timeout=TIMEOUT, max_output=MAX_OUTPUT, jobs=1):
+    '''
+    Run argv and return (returncode, output); returncode is None if the
+    command timed out and was killed.
+    '''
+    sink = output.get()
+    taken = _slots.acquire(jobs)
+    try:
+        proc = subprocess.Popen(argv, cwd=cwd, stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                start_new_session=True)
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        half = max_output // 2
+        head, tail, dropped = bytearray(), bytearray(), 0
+        # counted from now, after any wait for slots, but never past the
+        # caller's own deadline
+        end = time.monotonic() + timeout
+        if (limit := deadline.get()) is not None:
+            end = min(end, limit)
+        eof = False
+        try:
+            with selectors.DefaultSelector() as sel:
+                sel.register(proc.stdout, selectors.EVENT_READ)
+                while (left := end - time.monotonic()) > 0:
+                    if not sel.select(left):
+                        continue
+                    if not (data := os.read(proc.stdout.fileno(), 65536)):
+                        eof = True
+                        break
+                    if sink is not None and (text := decoder.decode(data)):
+                        sink(text)
+                    # keep the first half of the budget, and a rolling tail
+                    take = max(0, half - len(head))
+                    head += data[:take]
+                    tail += data[take:]
+                    if len(tail) > 2 * half:
+                        dropped += len(tail) - half
+                        del tail[:len(tail) - half]
+        finally:
+            # timed out, or the sink (or anything else) raised: stop it all
+            if not eof:
+                _kill(proc)
+            proc.stdout.close()
+        returncode = proc.wait() if eof else None
+    finally:
+        _slots.release(taken)
+    if len(tail) > half:
+        dropped += len(tail) - half
+        del tail[:len(tail) - half]
+    text = head.decode('utf-8', 'replace')
+    if dropped:
+        text += f'\n[... {dropped} bytes of output omitted ...]\n'
+    text += tail.decode('utf-8', 'replace')
+    return returncode, text
@@ -0,0 +1,146 @@
+'''
+Content-addressed cache of model rounds and tool results.
+
+Replaying a convo repeats the same requests: identical ollama.chat calls at
+temperature 0 and identical read-only tool calls.  With a `cache` header
+key these are answered from an on-disk store instead:
+
+    cache:
+      dir: .hallmoot-cache   # where entries live
+      max_bytes: 268435456   # least recently used entries go past this
+      model: true            # cache rounds at temperature 0 ('always': any)
+      tools: true            # cache the toolkit's CACHEABLE tools
+      replay: instant        # or 'timed', to keep the original pacing
+
+A model round is keyed by a hash of (model, options, format, tools,
+messages) and stored as the list of streamed chunks with the delay before
+each one.  A tool call is keyed by (tool name, arguments, mtime and size of
+the files named by its path arguments).
+'''
+import os
+import json
+import time
+import hashlib
+
+DIR = '.hallmoot-cache'
+MAX_BYTES = 256 * 1024 * 1024
+
+def _hash(obj):
+    data = json.dumps(obj, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+def _dump(obj):
+    if hasattr(obj, 'model_dump'):
+        return obj.model_dump(exclude_none=True)
+    return obj
+
+class respcache:
+    def __init__(self, dir=DIR, max_bytes=MAX_BYTES, model=True, tools=True, replay='instant'):
+        if replay not in ('instant', 'timed'):
+            raise ValueError(f"Unknown replay mode {replay!r}")
+        self.dir, self.max_bytes = dir, max_bytes
+        self.model, self.tools, self.replay = model, tools, replay
+        self.size = None  # bytes on disk, counted on first store
+        self.hits = self.misses = 0
+    def _path(self, key):
+        return os.path.join(self.dir, key[-64:-62], key + '.json')
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+            os.utime(path)  # mtime doubles as last use
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+    def put(self, key, value):
+        path = self._path(key)
+        data = json.dumps(value, separators=(',', ':'), default=str)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}'
+            with open(tmp, 'w') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        if self.size is None:
+            self.size = sum(e[2] for e in self._entries())
+        else:
+            self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+    def _entries(self):
+        for root, dirs, files in os.walk(self.dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield st.st_mtime, path, st.st_size
+    def evict(self):
+        '''Drop least recently used entries until the store is within bounds.'''
+        entries = sorted(self._entries())
+        self.size = sum(e[2] for e in entries)
+        target = self.max_bytes * 0.9
+        for mtime, path, size in entries:
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+    # -- model rounds -- #
+    def chat_key(self, args):
+        options = args.get('options') or {}
+        if self.model != 'always' and (not self.model or options.get('temperature') != 0):
+            return None
+        keys = ('model', 'options', 'format', 'think', 'tools')
+        # the messages as plain dicts (not a lazymessages, which json
+        # cannot encode), so that sort_keys makes a reloaded convo hash
+        # like the one that was recorded
+        messages = [dict(m) for m in args.get('messages') or []]
+        return 'chat-' + _hash({**{k: args.get(k) for k in keys}, 'messages': messages})
+    def chat(self, args, call):
+        '''Stream a round from the cache, or from call() while recording it.'''
+        if (key := self.chat_key(args)) is None:
+            yield from call()
+            return
+        if (cached := self.get(key)) is not None:
+            from ollama import ChatResponse
+            for delay, chunk in cached['chunks']:
+                if self.replay == 'timed':
+                    time.sleep(delay)
+                yield ChatResponse.model_validate(chunk)
+            return
+        chunks, last = [], time.monotonic()
+        for response in call():
+            now = time.monotonic()
+            chunks.append((now - last, _dump(response)))
+            last = now
+            yield response
+        self.put(key, {'chunks': chunks})
+    # -- tools -- #
+    def tool_key(self, name, args, paths):
+        '''Key for a tool call; paths are the files its result depends on.'''
+        if not self.tools:
+            return None
+        stats = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+                stats.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stats.append(None)
+        return 'tool-' + _hash([name, args, stats])
+    def tool_get(self, key):
+        if (cached := self.get(key)) is not None:
+            return cached['result']
+        return None
+    def tool_put(self, key, result):
+        if isinstance(result, str) and not result.startswith('Error:'):
+            self.put(key, {'result': result})
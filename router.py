@@ -0,0 +1,222 @@
+'''
+Routing model rounds across several ollama hosts.
+
+With a `backends` header key, rounds go to one of several hosts instead of
+the default one (OLLAMA_HOST):
+
+    backends:
+      hosts:
+        - host: http://gpu1:11434
+          concurrency: 2         # rounds at a time on this host (default: any)
+          models: [llama3.1]     # models it serves (default: all)
+        - http://gpu2:11434
+      policy: least              # or 'affinity'
+      check: 10                  # seconds before a failed host is probed again
+
+or `backends: backends.yml`, naming a YAML file that holds the same
+mapping.  Every host has its own ollama.Client, and so its own pool of
+persistent connections.
+
+'least' sends a round to the host with the fewest outstanding requests
+for its concurrency; 'affinity' keeps each model on one host (chosen by
+rendezvous hashing, so that losing a host only moves its own models),
+which keeps the model loaded and its prompt cache warm, and falls back to
+'least' while that host is full.  A host that fails to connect, or
+answers with a server error, before the first chunk of a round has been
+passed on is marked down and the round retried elsewhere; hosts that are
+down get a GET /api/version every `check` seconds until they answer.
+When every host that serves a model is at its concurrency limit, rounds
+wait for one to free up.  A chat with a timeout (see hallmoot.deadline)
+gives up with TimeoutError once it has spent that long waiting, failing
+over and streaming.
+
+Convos with the same configuration share one router, and so its counts.
+'''
+import json
+import time
+import hashlib
+import threading
+
+POLICIES = ('least', 'affinity')
+CHECK = 10.0
+PROBE_TIMEOUT = 2.0
+
+class backend:
+    def __init__(self, host, concurrency=None, models=None) -> None:
+        self.host, self.concurrency = host.rstrip('/'), concurrency
+        self.models = set(models) if models else None
+        self.outstanding = self.served = self.failures = 0
+        self.down_since = None
+        self._client = None
+        self._timed = threading.local()
+    @property
+    def client(self):
+        if self._client is None:
+            import ollama
+            self._client = ollama.Client(host=self.host)
+        return self._client
+    def timed_client(self, timeout):
+        '''A client of this thread's own, whose requests give up after timeout seconds.'''
+        if (client := getattr(self._timed, 'client', None)) is None:
+            import ollama
+            client = self._timed.client = ollama.Client(host=self.host)
+        return timed(client, timeout)
+    def serves(self, model) -> bool:
+        return self.models is None or model in self.models
+    def full(self) -> bool:
+        return self.concurrency is not None and self.outstanding >= self.concurrency
+    def load(self) -> float:
+        return self.outstanding / (self.concurrency or 1)
+    def probe(self) -> bool:
+        '''Whether the host answers GET /api/version.'''
+        from urllib.request import urlopen
+        try:
+            with urlopen(self.host + '/api/version', timeout=PROBE_TIMEOUT) as r:
+                return r.status == 200
+        except OSError:
+            return False
+    def stats(self) -> dict:
+        return {'outstanding': self.outstanding, 'served': self.served,
+                'failures': self.failures, 'up': self.down_since is None}
+
+def timed(client, timeout):
+    '''
+    client, with timeout for the requests it starts from now on; ollama's
+    chat takes no timeout of its own, so it is set on the client's httpx
+    client, which must not be shared with other threads.
+    '''
+    import httpx
+    client._client.timeout = httpx.Timeout(max(timeout, 0.001))
+    return client
+
+def _failed(e, deadline=None) -> bool:
+    '''Whether e means the host, rather than the request, is at fault.'''
+    import httpx
+    if deadline is not None and isinstance(e, httpx.TimeoutException):
+        return False  # the round ran out of time; the host may be fine
+    if isinstance(e, (httpx.TransportError, ConnectionError)):
+        return True
+    return getattr(e, 'status_code', 0) >= 500
+
+class router:
+    def __init__(self, hosts, policy='least', check=CHECK) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown routing policy {policy!r}")
+        if not hosts:
+            raise ValueError("No backends configured")
+        self.backends = [backend(h) if isinstance(h, str) else backend(**h) for h in hosts]
+        self.policy, self.check = policy, check
+        self.cond = threading.Condition()
+    def _probe(self, probes) -> None:
+        '''Probe hosts claimed by _pick, outside the lock; bring back those that answer.'''
+        for b in probes:
+            up = b.probe()
+            with self.cond:
+                # the next probe is an interval after this one ended
+                b.down_since = None if up else time.monotonic()
+                self.cond.notify_all()
+    def _pick(self, model, tried, deadline=None):
+        '''The backend for a round of model, waiting while all are full.'''
+        while True:
+            with self.cond:
+                now = time.monotonic()
+                usable = [b for b in self.backends if b not in tried and b.serves(model)]
+                # one probe per interval, whatever its outcome
+                probes = [b for b in usable
+                          if b.down_since is not None and now - b.down_since >= self.check]
+                for b in probes:
+                    b.down_since = now
+                candidates = [b for b in usable if b.down_since is None]
+                if not candidates and not probes:
+                    raise ConnectionError(f"No backend available for model {model}")
+                chosen = None
+                if self.policy == 'affinity' and candidates and not probes:
+                    chosen = max(candidates, key=lambda b: hashlib.sha1(
+                        f'{b.host} {model}'.encode()).digest())
+                    if chosen.full():
+                        chosen = None
+                if chosen is None and not probes and (free := [b for b in candidates if not b.full()]):
+                    chosen = min(free, key=backend.load)
+                if chosen is not None:
+                    chosen.outstanding += 1
+                    return chosen
+                if not probes:
+                    wait = self.check
+                    if deadline is not None:
+                        if (wait := min(wait, deadline - now)) <= 0:
+                            raise TimeoutError(f"No backend free for model {model} in time")
+                    self.cond.wait(wait)
+                    continue
+            # probing takes up to PROBE_TIMEOUT; let other rounds go meanwhile
+            self._probe(probes)
+    def _release(self, b, failed=False) -> None:
+        with self.cond:
+            b.outstanding -= 1
+            if failed:
+                b.failures += 1
+                b.down_since = time.monotonic()
+            else:
+                b.served += 1
+            self.cond.notify_all()
+    def _client(self, b, deadline):
+        if deadline is None:
+            return b.client
+        return b.timed_client(deadline - time.monotonic())
+    def chat(self, model, stream=False, timeout=None, **args):
+        '''
+        Like ollama.Client.chat, on whichever backend the policy picks;
+        with a timeout, TimeoutError (or httpx's) once that many seconds
+        have passed.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if stream:
+            return self._stream(model, args, deadline)
+        tried = []
+        while True:
+            b = self._pick(model, tried, deadline)
+            try:
+                response = self._client(b, deadline).chat(model=model, **args)
+            except Exception as e:
+                self._release(b, _failed(e, deadline))
+                if not _failed(e, deadline):
+                    raise
+                tried.append(b)
+                continue
+            self._release(b)
+            return response
+    def _stream(self, model, args, deadline):
+        tried = []
+        while True:
+            b = self._pick(model, tried, deadline)
+            started, failed = False, False
+            try:
+                for chunk in self._client(b, deadline).chat(model=model, stream=True, **args):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                failed = _failed(e, deadline)
+                if started or not failed:
+                    raise
+                tried.append(b)
+            finally:
+                self._release(b, failed)
+    def stats(self) -> dict:
+        return {b.host: b.stats() for b in self.backends}
+
+_routers = {}
+_lock = threading.Lock()
+
+def configure(config) -> router:
+    '''The router for a `backends` header value: a mapping, a host list or a file.'''
+    if isinstance(config, str):
+        import yaml
+        with open(config) as f:
+            config = yaml.safe_load(f)
+    if isinstance(config, list):
+        config = {'hosts': config}
+    key = json.dumps(config, sort_keys=True)
+    with _lock:
+        if key not in _routers:
+            _routers[key] = router(**config)
+        return _routers[key]
@@ -5,6 +5,16 @@ Usage: hallmoot <filename>
 
 __version__ = '1.0.1'
 
+_sync_client = None
+
+def _client():
+    '''The ollama.Client, and its pool of HTTP connections, shared by every convo.'''
+    global _sync_client
+    if _sync_client is None:
+        import ollama
+        _sync_client = ollama.Client()
+    return _sync_client
+
 class hallmoot:
     def __init__(self, filename) -> None:
         self.filename = filename
@@ -50,9 +60,8 @@ class hallmoot:
             pass
         pass
     def user_round(self) -> bool:
-        import ollama
         contents, tool_calls = [], []
-        for response in ollama.chat(**self.convo, stream=True):
+        for response in _client().chat(**self.convo, stream=True):
             message = response.message
             if message.content:
                 if not contents:
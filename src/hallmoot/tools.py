@@ -65,3 +65,8 @@ def rm_file(filepath):
         return "File removed successfully."
     except Exception as e:
         return f"Error: {e}"
+
+# tools with side effects that must not run concurrently with other calls
+SERIAL = {'write_file', 'rm_file'}
+# tools without side effects, which may start while the model still streams
+READONLY = {'list_files', 'read_file'}
@@ -0,0 +1,25 @@
+'''
+A stand-in ollama server (bench/mockollama.py) for tests that run rounds.
+'''
+import pytest
+import mockollama
+
+SCRIPT = {k: v for k, v in vars(mockollama.script).items() if not k.startswith('_')}
+
+@pytest.fixture(scope='session')
+def _server():
+    server = mockollama.serve(0)
+    yield server
+    server.shutdown()
+
+@pytest.fixture
+def mock(_server, tmp_path, monkeypatch):
+    '''The mock's script, with the shared client pointed at it and cwd in tmp_path.'''
+    import hallmoot
+    monkeypatch.setenv('OLLAMA_HOST', f'http://127.0.0.1:{_server.server_address[1]}')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    monkeypatch.setattr(hallmoot, '_sync_client', None)
+    monkeypatch.chdir(tmp_path)
+    for k, v in SCRIPT.items():
+        setattr(mockollama.script, k, v)
+    yield mockollama.script
@@ -0,0 +1,38 @@
+'''
+Large tool results in the blob store (see blobstore), and what is sent.
+'''
+from blobstore import blobstore
+from convocodec import create
+from convostore import estimate
+from hallmoot import hallmoot
+
+def test_only_blob_ids_are_read(tmp_path):
+    store = blobstore(str(tmp_path / 'convo.yml'))
+    blob = store.put('x' * 100)
+    assert store.read_blob(blob) == 'x' * 100
+    for bad in ('/etc/hostname', '../../etc/hostname', blob.upper(), blob[:-1], blob + '0'):
+        assert store.get(bad) is None
+        assert store.read_blob(bad).startswith('Error:')
+
+def test_context_window_counts_resolved_blobs(tmp_path):
+    filename = str(tmp_path / 'convo.yml')
+    create(filename, {'model': 'mock', 'blobs': {'dir': 'blobs'},
+                      'context': {'budget': 20000, 'recent': 5}})
+    hm = hallmoot(filename)
+    for i in range(30):
+        hm.messages.append({'role': 'user', 'content': f'question {i} ' + 'x' * 2000})
+        hm.messages.append({'role': 'assistant', 'content': 'y' * 2000})
+    call = {'function': {'name': 'read_file', 'arguments': {'filepath': 'big.txt'}}}
+    turn = [{'role': 'user', 'content': 'read them'},
+            {'role': 'assistant', 'content': '', 'tool_calls': [call] * 3}]
+    hm.messages.extend(turn)
+    for i in range(3):
+        hm.messages.append(hm.blobs.stash({'role': 'tool', 'name': 'read_file',
+                                           'content': str(i) * 65536}))
+    view = hm._chat_args()['messages']
+    hm.close()
+    # the current turn's results go out in full, and push everything older
+    # out of the window
+    assert view[:2] == turn
+    assert [m['content'] for m in view[2:]] == [str(i) * 65536 for i in range(3)]
+    assert sum(estimate(m) for m in view) > 20000
@@ -0,0 +1,123 @@
+'''
+Round trips of convos through every encoding (see convocodec), and
+branches written in each of them.
+'''
+import os
+import pytest
+import convocodec
+from convocodec import CODECS, FRAME, MAGIC, COMPRESS_MIN, convert, create
+from convostore import convostore, convowriter, branch_point
+
+EXT = {'yaml': '.yml', 'jsonl': '.jsonl', 'framed': '.hmc'}
+
+HEADER = {'model': 'llama3.1', 'options': {'num_ctx': 8192}, 'tools': ['read_file']}
+MESSAGES = [
+    {'role': 'system', 'content': 'You are terse.'},
+    {'role': 'user', 'content': 'first line\nsecond line\n\n  indented, after a blank\n'},
+    {'role': 'assistant', 'content': 'A YAML stream:\n---\nkey: value\n---\n...\n--- inline'},
+    {'role': 'assistant', 'content': '',
+     'tool_calls': [{'function': {'name': 'read_file', 'arguments': {'filepath': 'big.txt'}}}]},
+    {'role': 'tool', 'name': 'read_file',
+     'content': ''.join(f'{i:05} ---- é \t "quoted" {{json}}\n' for i in range(400))},
+    {'role': 'user', 'content': '---'},
+    {'role': 'assistant', 'content': 'trailing spaces   \n\ttab\r\nand a CRLF'},
+]
+
+def write(filename, header, messages, codec=None):
+    create(filename, header, codec)
+    writer = convowriter(filename, 'none')
+    for message in messages:
+        writer.write(message)
+    writer.close()
+
+def data(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def read(filename):
+    header, messages = convostore(filename).load(eager=0)
+    return header, list(messages)
+
+def test_big_tool_result_is_over_the_compression_threshold():
+    assert len(MESSAGES[4]['content'].encode()) > COMPRESS_MIN
+
+def test_yaml_jsonl_framed_yaml(tmp_path):
+    names = [str(tmp_path / f'convo{i}{EXT[c]}') for i, c in enumerate(('yaml', 'jsonl', 'framed', 'yaml'))]
+    write(names[0], HEADER, MESSAGES)
+    for src, dst in zip(names, names[1:]):
+        assert convert(src, dst) == len(MESSAGES) + 1
+        assert read(dst) == (HEADER, MESSAGES)
+    assert [convocodec.for_file(n).name for n in names] == ['yaml', 'jsonl', 'framed', 'yaml']
+    assert data(names[0]) == data(names[3])
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_round_trip(tmp_path, codec):
+    filename = str(tmp_path / f'convo{EXT[codec]}')
+    write(filename, HEADER, MESSAGES)
+    assert read(filename) == (HEADER, MESSAGES)
+    # once more from the index written by the first read
+    assert read(filename) == (HEADER, MESSAGES)
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_codec_header_key_picks_the_encoding(tmp_path, codec):
+    filename = str(tmp_path / 'convo.yml')
+    write(filename, {**HEADER, 'codec': codec}, MESSAGES)
+    assert convocodec.for_file(filename).name == codec
+    assert read(filename) == ({**HEADER, 'codec': codec}, MESSAGES)
+
+def test_framed_compresses_large_payloads_only(tmp_path):
+    filename = str(tmp_path / 'convo.hmc')
+    write(filename, HEADER, MESSAGES)
+    raw = data(filename)
+    assert raw.startswith(MAGIC)
+    frames = []
+    for offset, length, _, size in convostore(filename).records():
+        stored, decoded, role, compression = FRAME.unpack_from(raw, offset)
+        frames.append((stored, decoded, compression))
+    compressed = [i for i, (_, decoded, compression) in enumerate(frames) if compression]
+    assert compressed == [5]  # the header is frame 0, the tool result frame 5
+    stored, decoded, _ = frames[5]
+    assert stored < decoded
+
+def test_appending_after_reopen(tmp_path):
+    for codec in CODECS:
+        filename = str(tmp_path / f'convo{EXT[codec]}')
+        write(filename, HEADER, MESSAGES[:3])
+        assert read(filename) == (HEADER, MESSAGES[:3])
+        writer = convowriter(filename, 'none')
+        for message in MESSAGES[3:]:
+            writer.write(message)
+        writer.close()
+        assert read(filename) == (HEADER, MESSAGES)
+
+@pytest.mark.parametrize('parent_codec', CODECS)
+@pytest.mark.parametrize('codec', CODECS)
+def test_branch(tmp_path, parent_codec, codec):
+    parent = str(tmp_path / f'parent{EXT[parent_codec]}')
+    write(parent, HEADER, MESSAGES)
+    path, length = branch_point(parent, 5)
+    assert path == parent
+    branch = str(tmp_path / f'branch{EXT[codec]}')
+    own = [{'role': 'user', 'content': 'instead:\n---\nsomething else'}]
+    write(branch, {'branch': path, 'length': length, 'options': {'num_ctx': 4096}}, own)
+    header, messages = read(branch)
+    assert header == {**HEADER, 'options': {'num_ctx': 4096}}
+    assert messages == MESSAGES[:5] + own
+    # the parent is unchanged
+    assert read(parent) == (HEADER, MESSAGES)
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_branch_of_a_branch(tmp_path, codec):
+    parent = str(tmp_path / f'parent{EXT[codec]}')
+    write(parent, HEADER, MESSAGES)
+    first = str(tmp_path / f'first{EXT[codec]}')
+    a = [{'role': 'user', 'content': 'a'}, {'role': 'assistant', 'content': 'b\n---\nc'}]
+    write(first, dict(zip(('branch', 'length'), branch_point(parent, 3))), a)
+    # a point inside the inherited messages goes back to the parent
+    assert branch_point(first, 2) == branch_point(parent, 2)
+    second = str(tmp_path / f'second{EXT[codec]}')
+    b = [{'role': 'tool', 'name': 'read_file', 'content': MESSAGES[4]['content'][::-1]}]
+    write(second, dict(zip(('branch', 'length'), branch_point(first, 4))), b)
+    assert read(second) == (HEADER, MESSAGES[:3] + a[:1] + b)
+    assert read(first) == (HEADER, MESSAGES[:3] + a)
+    assert os.path.exists(first + '.idx')
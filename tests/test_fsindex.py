@@ -0,0 +1,58 @@
+'''
+Listings from the file index (see fsindex) and list_files.
+'''
+import json
+import os
+import pytest
+import hallmoot
+from fsindex import fsindex, _parse_ignore
+
+FILES = ['build/a', 'src/build/b', 'src/out', 'out/c', 'x.log', 'keep.log',
+         'logs/keep.log', '.git/HEAD', 'docs/tmp/d', 'tmp/e']
+IGNORE = '''\
+# comments and blank lines are skipped
+
+/build
+*.log
+!keep.log
+out/
+docs/tmp
+'''
+
+@pytest.fixture
+def tree(tmp_path):
+    for name in FILES:
+        os.makedirs(tmp_path / os.path.dirname(name), exist_ok=True)
+        (tmp_path / name).write_text(name)
+    (tmp_path / '.gitignore').write_text(IGNORE)
+    return tmp_path
+
+def test_parse_ignore():
+    assert _parse_ignore(IGNORE) == [
+        ('build', False, False, True),
+        ('*.log', False, False, False),
+        ('keep.log', True, False, False),
+        ('out', False, True, False),
+        ('docs/tmp', False, False, True),
+    ]
+
+def test_walk_with_gitignore(tree):
+    paths = fsindex(str(tree)).walk(gitignore=True)
+    # /build and docs/tmp only match at the top, keep.log is let back in
+    assert sorted(paths) == ['.gitignore', 'docs', 'keep.log', 'logs', 'logs/keep.log',
+                             'src', 'src/build', 'src/build/b', 'src/out', 'tmp', 'tmp/e']
+
+def test_walk_without_gitignore(tree):
+    paths = fsindex(str(tree)).walk()
+    assert set(FILES) <= set(paths)
+    assert '.git' in paths
+
+def test_list_files_ignores_nothing_unless_asked(tree, monkeypatch):
+    monkeypatch.chdir(tree.parent)
+    monkeypatch.setattr(hallmoot, 'SANDBOX', tree.name)
+    monkeypatch.setattr(hallmoot, '_index', None)
+    listed = json.loads(hallmoot.list_files('.'))
+    assert sorted(listed) == sorted(['.git', '.gitignore', 'build', 'docs', 'keep.log',
+                                     'logs', 'out', 'src', 'tmp', 'x.log'])
+    listed = json.loads(hallmoot.list_files('.', gitignore=True))
+    assert sorted(listed) == ['.gitignore', 'docs', 'keep.log', 'logs', 'src', 'tmp']
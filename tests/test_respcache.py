@@ -0,0 +1,42 @@
+'''
+Model rounds served from the response cache (see respcache).
+'''
+import mockollama
+from convocodec import create
+from convostore import branch_point
+from hallmoot import hallmoot
+
+def open_quiet(filename):
+    hm = hallmoot(filename)
+    hm.display_user = lambda text: None
+    return hm
+
+def test_round_replayed_after_reopening(mock, tmp_path):
+    create('convo.yml', {'model': 'mock', 'options': {'temperature': 0},
+                         'cache': {'dir': str(tmp_path / 'cache')}})
+    hm = open_quiet('convo.yml')
+    message = {'role': 'user', 'content': 'hello'}
+    hm.messages.append(message)
+    hm._persist_message(message)
+    hm.user_round()
+    recorded = hm.messages[-1]['content']
+    hm.close()
+    requests = mockollama.handler.requests
+    # the same prefix, now read back from the file, in a branch after it
+    parent, length = branch_point('convo.yml', 1)
+    create('replay.yml', {'branch': parent, 'length': length})
+    hm = open_quiet('replay.yml')
+    assert list(hm.messages) == [message]
+    hm.user_round()
+    assert (hm.cache.hits, hm.cache.misses) == (1, 0)
+    assert hm.messages[-1]['content'] == recorded
+    hm.close()
+    assert mockollama.handler.requests == requests
+
+def test_round_not_cached_above_temperature_zero(mock, tmp_path):
+    create('convo.yml', {'model': 'mock', 'cache': {'dir': str(tmp_path / 'cache')}})
+    hm = open_quiet('convo.yml')
+    hm.messages.append({'role': 'user', 'content': 'hello'})
+    hm.user_round()
+    assert (hm.cache.hits, hm.cache.misses) == (0, 0)
+    hm.close()
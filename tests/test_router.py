@@ -0,0 +1,154 @@
+'''
+Routing rounds across stand-in ollama hosts (see router).
+'''
+import socket
+import threading
+import time
+import pytest
+import mockollama
+import router
+
+MESSAGES = [{'role': 'user', 'content': 'hello'}]
+
+@pytest.fixture(scope='module')
+def _second():
+    server = mockollama.serve(0)
+    yield server
+    server.shutdown()
+
+@pytest.fixture
+def hosts(mock, _server, _second):
+    mock.tokens = 5
+    return [f'http://127.0.0.1:{s.server_address[1]}' for s in (_server, _second)]
+
+@pytest.fixture
+def dead():
+    '''A host nothing listens on.'''
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return f'http://127.0.0.1:{s.getsockname()[1]}'
+
+def served(r):
+    return [s['served'] for s in r.stats().values()]
+
+def rounds(r, n, model='mock', stream=True):
+    '''Run n rounds at once; return the most outstanding at any time, per host.'''
+    peak = {b.host: 0 for b in r.backends}
+    def one():
+        chunks = r.chat(model=model, messages=MESSAGES, stream=stream)
+        for _ in (chunks if stream else [chunks]):
+            for b in r.backends:
+                peak[b.host] = max(peak[b.host], b.outstanding)
+    threads = [threading.Thread(target=one) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return list(peak.values())
+
+def test_least_spreads_concurrent_rounds(hosts, mock):
+    mock.latency = 0.2
+    r = router.router(hosts)
+    rounds(r, 4)
+    assert served(r) == [2, 2]
+
+def test_least_prefers_the_first_idle_host(hosts):
+    r = router.router(hosts)
+    for _ in range(3):
+        assert r.chat(model='mock', messages=MESSAGES).message.content
+    assert served(r) == [3, 0]
+
+def test_affinity_keeps_each_model_on_one_host(hosts):
+    r = router.router(hosts, policy='affinity')
+    homes = {}
+    for model in ('a', 'b', 'c', 'd', 'e', 'f') * 2:
+        before = served(r)
+        list(r.chat(model=model, messages=MESSAGES, stream=True))
+        home = [i for i, (x, y) in enumerate(zip(before, served(r))) if y > x]
+        assert homes.setdefault(model, home) == home
+    # six models over two hosts: both get some
+    assert all(served(r))
+
+def test_affinity_falls_back_while_its_host_is_full(hosts, mock):
+    mock.latency = 0.2
+    r = router.router([{'host': h, 'concurrency': 1} for h in hosts], policy='affinity')
+    rounds(r, 2)
+    assert served(r) == [1, 1]
+
+def test_concurrency_limit(hosts, mock):
+    mock.latency = 0.2
+    r = router.router([{'host': h, 'concurrency': 1} for h in hosts])
+    assert rounds(r, 4) == [1, 1]
+    assert served(r) == [2, 2]
+    t = time.monotonic()
+    rounds(r, 4, stream=False)
+    assert served(r) == [4, 4]
+    assert time.monotonic() - t >= 0.4  # two waves of two
+
+def test_models_served(hosts):
+    r = router.router([{'host': hosts[0], 'models': ['other']}, hosts[1]])
+    r.chat(model='mock', messages=MESSAGES)
+    assert served(r) == [0, 1]
+    with pytest.raises(ConnectionError):
+        router.router([{'host': hosts[0], 'models': ['other']}]).chat(model='mock', messages=MESSAGES)
+
+@pytest.mark.parametrize('stream', (False, True))
+def test_failover_marks_the_host_down(hosts, dead, stream):
+    r = router.router([dead, hosts[0]], check=60)
+    for _ in range(2):
+        response = r.chat(model='mock', messages=MESSAGES, stream=stream)
+        if stream:
+            response = list(response)[-1]
+        assert response.done
+    stats = r.stats()
+    assert stats[dead] == {'outstanding': 0, 'served': 0, 'failures': 1, 'up': False}
+    assert stats[hosts[0]]['served'] == 2
+
+def test_every_host_down(dead):
+    r = router.router([dead], check=60)
+    with pytest.raises(ConnectionError):
+        r.chat(model='mock', messages=MESSAGES)
+    with pytest.raises(ConnectionError):
+        r.chat(model='mock', messages=MESSAGES)
+
+def test_down_host_comes_back_after_a_probe(hosts):
+    r = router.router(hosts, check=0.1)
+    r.backends[0].down_since = time.monotonic()
+    r.chat(model='mock', messages=MESSAGES)
+    assert served(r) == [0, 1]
+    time.sleep(0.15)
+    r.chat(model='mock', messages=MESSAGES)
+    assert served(r) == [1, 1]
+    assert r.stats()[hosts[0]]['up']
+
+def test_probe_does_not_hold_the_lock(hosts, monkeypatch):
+    monkeypatch.setattr(router, 'PROBE_TIMEOUT', 1.0)
+    with socket.socket() as hung:
+        # accepts connections (into the backlog) but never answers
+        hung.bind(('127.0.0.1', 0))
+        hung.listen()
+        host = f'http://127.0.0.1:{hung.getsockname()[1]}'
+        r = router.router([host, hosts[0]], check=0.1)
+        r.backends[0].down_since = time.monotonic() - 1
+        picked = []
+        t = threading.Thread(target=lambda: picked.append(r._pick('mock', [])))
+        t.start()
+        time.sleep(0.2)  # now probing
+        started = time.monotonic()
+        with r.cond:
+            waited = time.monotonic() - started
+        t.join()
+    assert waited < 0.1
+    assert picked[0].host == hosts[0]
+    assert not r.stats()[host]['up']
+
+def test_timeout_while_waiting_for_a_host(hosts, mock):
+    mock.latency = 0.5
+    r = router.router([{'host': hosts[0], 'concurrency': 1}])
+    t = threading.Thread(target=lambda: r.chat(model='mock', messages=MESSAGES))
+    t.start()
+    time.sleep(0.1)
+    with pytest.raises(TimeoutError):
+        r.chat(model='mock', messages=MESSAGES, timeout=0.1)
+    t.join()
+    assert r.stats()[hosts[0]]['up']
@@ -0,0 +1,73 @@
+'''
+JSON schemas for tool functions, built once and cached.
+
+ollama.chat accepts tools either as Python callables, which it introspects
+(signature plus Google-style docstring) on every request, or as ready-made
+schemas.  We build the schemas once per toolkit module with ollama's own
+converter and keep them in memory for every convo in the process, and on
+disk keyed by module path and mtime so that a new process starts warm.
+'''
+import os
+import sys
+import json
+import hashlib
+
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                         'hallmoot', 'tools')
+
+_registry = {}  # (module path, mtime_ns) -> {tool name: schema}
+
+def _module_key(fn):
+    mod = sys.modules.get(getattr(fn, '__module__', None) or '')
+    path = getattr(mod, '__file__', None)
+    if not path:
+        return None
+    path = os.path.abspath(path)
+    try:
+        return path, os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _cache_file(key):
+    name = hashlib.sha1(key[0].encode()).hexdigest()
+    return os.path.join(CACHE_DIR, f'{name}.json')
+
+def _load(key):
+    try:
+        with open(_cache_file(key)) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cached['schemas'] if cached.get('mtime') == key[1] else {}
+
+def _save(key, schemas):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = _cache_file(key) + f'.{os.getpid()}'
+        with open(tmp, 'w') as f:
+            json.dump({'path': key[0], 'mtime': key[1], 'schemas': schemas}, f, sort_keys=True)
+        os.replace(tmp, _cache_file(key))
+    except OSError:
+        pass
+
+def _build(name, fn):
+    from ollama._utils import convert_function_to_tool
+    tool = convert_function_to_tool(fn).model_dump(exclude_none=True)
+    tool['function']['name'] = name
+    return tool
+
+def schema(name, fn):
+    '''The JSON schema of tool fn, registered under name.'''
+    if (key := _module_key(fn)) is None:
+        return _build(name, fn)
+    if key not in _registry:
+        _registry[key] = _load(key)
+    schemas = _registry[key]
+    if name not in schemas:
+        schemas[name] = _build(name, fn)
+        _save(key, schemas)
+    return schemas[name]
+
+def schemas(tools):
+    '''Schemas for a {name: function} dict of tools, in name order.'''
+    return [schema(name, tools[name]) for name in sorted(tools)]
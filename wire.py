@@ -0,0 +1,56 @@
+'''
+Websocket framing shared by ws.py, chat.py and llm.py.
+
+Protocol 1, the default, sends every message as two frames: the channel,
+then the payload.  A client asks for protocol 2 by connecting with
+`?proto=2`; each message is then a single text frame holding the JSON
+array [channel, payload].  With `&deflate=1` as well, frames of
+DEFLATE_MIN bytes or more travel as binary frames of zlib-compressed JSON.
+
+A streamed reply (llm.py's output for one request) ends with a message on
+the same channel whose payload is EOS.
+'''
+import json
+import zlib
+
+PROTO = 2
+DEFLATE_MIN = 1024
+EOS = '\x04'  # ASCII end of transmission
+
+def encode(channel, payload, deflate=False):
+    '''One frame for a message: str for a text frame, bytes for binary.'''
+    frame = json.dumps([channel, payload], separators=(',', ':'))
+    if deflate and len(frame) >= DEFLATE_MIN:
+        return zlib.compress(frame.encode('utf-8'))
+    return frame
+
+def decode(frame):
+    '''Return (channel, payload) from a frame made by encode.'''
+    if isinstance(frame, (bytes, bytearray)):
+        frame = zlib.decompress(frame).decode('utf-8')
+    channel, payload = json.loads(frame)
+    if not isinstance(payload, str):
+        payload = json.dumps(payload)
+    return str(channel), payload
+
+def query(proto=PROTO, deflate=True):
+    '''Query parameters asking ws.py for a protocol.'''
+    return f'proto={proto}&deflate={int(deflate)}' if proto != 1 else 'proto=1'
+
+def send(ws, channel, payload, proto=PROTO, deflate=True):
+    '''Send a message over a websocket-client connection.'''
+    if proto == 1:
+        ws.send(channel)
+        ws.send(payload)
+        return
+    frame = encode(channel, payload, deflate)
+    if isinstance(frame, bytes):
+        ws.send_binary(frame)
+    else:
+        ws.send(frame)
+
+def recv(ws, proto=PROTO):
+    '''Receive a message from a websocket-client connection.'''
+    if proto == 1:
+        return ws.recv(), ws.recv()
+    return decode(ws.recv())
@@ -1,32 +1,125 @@
 #!/usr/bin/env python3
-from gevent import monkey as _;_.patch_all()
+# patch only when run as a server; importing this module changes nothing
+if __name__ == '__main__': from gevent import monkey as _;_.patch_all()
 import bottle
+import gevent
+from gevent.event import Event
 from geventwebsocket import WebSocketServer
-from collections import UserDict
+from collections import UserDict, deque
+import uuid
+import wire
 
-def hexid(ws):
-    return hex(id(ws))[2:]
+def hexid():
+    # a client's id names its private channel and its convo in llm.py, so it
+    # must never be handed out twice (as id() of a freed socket would be)
+    return uuid.uuid4().hex
+
+QUEUE_SIZE = 1024  # messages waiting per subscriber before OVERFLOW applies
+OVERFLOW = 'drop'  # 'drop' the oldest, 'coalesce' into the newest, or 'disconnect'
+# 'coalesce' only merges streamed text on the client's own channel; anything
+# else (JSON, wire.EOS) is dropped from the front as with 'drop'
+
+class outbox:
+    """Messages waiting for one websocket, sent by a greenlet of its own."""
+    def __init__(self, ws, size=QUEUE_SIZE, overflow=OVERFLOW, proto=1, deflate=False,
+                 stream=None):
+        self.ws, self.size, self.overflow = ws, size, overflow
+        self.proto, self.deflate = proto, deflate
+        self.stream = stream  # the channel llm.py streams replies to this client on
+        self.queue = deque()
+        self.ready = Event()
+        self.channels = set()
+        self.sent = self.dropped = 0
+        self.closed = False
+        self.greenlet = gevent.spawn(self.drain)
+    def put(self, channel, message):
+        if self.closed:
+            return
+        queue = self.queue
+        if len(queue) >= self.size:
+            if self.overflow == 'disconnect':
+                print("OVERFLOW", sorted(self.channels))
+                self.close()
+                gevent.spawn(self.ws.close)  # not while pub walks the set
+                return
+            last = queue[-1]
+            if (self.overflow == 'coalesce' and channel == self.stream == last[0] and
+                isinstance(last[1], str) and isinstance(message, str) and
+                wire.EOS not in (last[1], message)):
+                queue[-1] = (channel, last[1] + message)
+                return
+            queue.popleft()
+            self.dropped += 1
+        queue.append((channel, message))
+        self.ready.set()
+    def drain(self):
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self.ready.clear()
+                    self.ready.wait()
+                    continue
+                channel, message = self.queue.popleft()
+                if self.proto == 1:
+                    self.ws.send(channel)
+                    self.ws.send(message)
+                else:
+                    self.ws.send(wire.encode(channel, message, self.deflate))
+                self.sent += 1
+        except Exception as e:
+            print("SEND ERROR", e)
+            self.closed = True
+    def close(self):
+        self.closed = True
+        self.ready.set()
 
 class pubsub(UserDict):
-    def __init__(self):
+    def __init__(self, size=QUEUE_SIZE, overflow=OVERFLOW):
         self.data = {}
-    def sub(self, ws, channels):
+        self.outboxes = {}
+        self.size, self.overflow = size, overflow
+        self.published = 0
+    def stats(self):
+        boxes = self.outboxes.values()
+        return {
+            'channels': {c: len(s) for c, s in self.data.items()},
+            'connections': len(self.outboxes),
+            'published': self.published,
+            'queued': sum(len(b.queue) for b in boxes),
+            'max_queued': max((len(b.queue) for b in boxes), default=0),
+            'sent': sum(b.sent for b in boxes),
+            'dropped': sum(b.dropped for b in boxes),
+        }
+    def outbox(self, ws, proto=1, deflate=False, stream=None):
+        if ws not in self.outboxes:
+            self.outboxes[ws] = outbox(ws, self.size, self.overflow, proto, deflate, stream)
+        return self.outboxes[ws]
+    def sub(self, ws, channels, proto=1, deflate=False, stream=None):
+        box = self.outbox(ws, proto, deflate, stream)
         for channel in channels:
             if channel not in self.data:
-                self.data[channel] = list()
-            self.data[channel].append(ws)
+                self.data[channel] = set()
+            self.data[channel].add(ws)
+            box.channels.add(channel)
     def unsub(self, ws, channels):
         for channel in channels:
             if channel in self.data:
-                self.data[channel].remove(ws)
+                self.data[channel].discard(ws)
                 if not self.data[channel]:
                     del self.data[channel]
+        if box := self.outboxes.get(ws):
+            box.channels.difference_update(channels)
+            if not box.channels:
+                del self.outboxes[ws]
+                box.close()
+    def send(self, ws, channel, message):
+        self.outbox(ws).put(channel, message)
     def pub(self, channel, message, ws_in=None):
+        self.published += 1
         if channel in self.data:
             for ws in self.data[channel]:
                 if ws is not ws_in:
-                    ws.send(channel)
-                    ws.send(message)
+                    self.outboxes[ws].put(channel, message)
 
 app = bottle.Bottle()
 app.ps = pubsub()
@@ -36,30 +129,41 @@ def websocket():
     ws = bottle.request.environ.get('wsgi.websocket')
     if not ws:
         raise bottle.abort(400)
-    wsid = hex(id(ws))[2:]
+    wsid = hexid()
     channels = bottle.request.query.channels or ''
     channels = [c.strip() for c in channels.split(',') if c.strip()]
     channels.append(wsid)
-    print("CHANNELS", channels)
+    # protocol 2 carries channel and payload in one frame (see wire.py)
+    proto = 2 if bottle.request.query.proto == '2' else 1
+    deflate = bottle.request.query.deflate == '1'
+    print("CHANNELS", channels, "PROTO", proto)
     try:
-        app.ps.sub(ws, channels)
+        app.ps.sub(ws, channels, proto, deflate, stream=wsid)
         while True:
             print("RECV")
-            if not (c := ws.receive()):
+            if proto == 2:
+                if not (frame := ws.receive()):
+                    print("BREAK1")
+                    break
+                c, p = wire.decode(frame)
+            elif not (c := ws.receive()):
                 print("BREAK1")
                 break
-            print("CHANNEL", c)
-            if not (p := ws.receive()):
+            elif not (p := ws.receive()):
                 print("BREAK2")
                 break
             print("MESSAGE", p)
             if c=='hello':
                 print("HELLO")
-                ws.send("welcome")
                 import json
                 s = json.dumps({"id":wsid})
                 print((33,s))
-                ws.send(s)
+                app.ps.send(ws, "welcome", s)
+            elif c=='stats' and p=='get':
+                # broker counters; round metrics from llm.py are published
+                # on the same channel
+                import json
+                app.ps.send(ws, "stats", json.dumps(app.ps.stats()))
             else:
                 app.ps.pub(c, p, ws_in=ws)
     except Exception as e:
@@ -0,0 +1,135 @@
+'''
+A websocket client for ws.py that stays up.
+
+wsclient connects with the wire protocol and subscribes to its channels
+through the URL, as ws.py expects.  A reader thread (a greenlet under
+gevent) receives messages into a queue of at most QUEUE_SIZE; while the
+queue is full it stops reading, so that the server's outbox for us fills
+up and its overflow policy applies, instead of our memory growing.
+
+When the connection drops, the reader reconnects with exponential backoff
+(up to MAX_BACKOFF seconds) to the same URL, and so to the same channels,
+and calls on_connect again.  A quiet connection is pinged every IDLE
+seconds so that a dead one is noticed.  Sends wait up to SEND_TIMEOUT for
+a connection.
+
+Streamed replies end with a message whose payload is wire.EOS; stream()
+yields the payloads of one reply.
+'''
+import time
+import queue
+import threading
+import wire
+
+QUEUE_SIZE = 1024     # received messages waiting to be read
+IDLE = 30.0           # seconds without traffic before a ping
+MAX_BACKOFF = 30.0    # longest wait between reconnection attempts
+SEND_TIMEOUT = 30.0   # seconds a send waits for a connection
+
+class wsclient:
+    def __init__(self, url, channels=(), proto=wire.PROTO, deflate=True,
+                 size=QUEUE_SIZE, on_connect=None) -> None:
+        self.base, self.channels = url, list(channels)
+        self.proto, self.deflate = proto, deflate
+        self.on_connect = on_connect
+        self.queue = queue.Queue(size)
+        self.ws, self.closed = None, False
+        self.connected = threading.Event()
+        self.lock = threading.Lock()  # one frame (or frame pair) at a time
+        self.reconnects = 0
+        self._connect()
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+    @property
+    def url(self) -> str:
+        query = wire.query(self.proto, self.deflate)
+        return f"{self.base}?channels={','.join(self.channels)}&{query}"
+    def _connect(self) -> None:
+        from websocket import create_connection
+        self.ws = create_connection(self.url, timeout=IDLE)
+        self.connected.set()
+        if self.on_connect is not None:
+            self.on_connect(self)
+    def _drop(self, ws) -> None:
+        with self.lock:
+            if self.ws is ws:
+                self.connected.clear()
+        try:
+            ws.close()
+        except Exception:
+            pass
+    def _reconnect(self) -> None:
+        backoff = 0.5
+        while not self.closed:
+            try:
+                self._connect()
+                self.reconnects += 1
+                return
+            except Exception:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+    def _read(self) -> None:
+        from websocket import WebSocketTimeoutException
+        while not self.closed:
+            ws = self.ws
+            try:
+                message = wire.recv(ws, self.proto)
+            except WebSocketTimeoutException:
+                try:
+                    ws.ping()
+                    continue
+                except Exception:
+                    pass
+            except Exception:
+                pass
+            else:
+                self.queue.put(message)  # blocks while full: backpressure
+                continue
+            if self.closed:
+                break
+            self._drop(ws)
+            self._reconnect()
+    def send(self, channel, payload) -> None:
+        if not self.connected.wait(SEND_TIMEOUT):
+            raise ConnectionError(f"Not connected to {self.base}")
+        with self.lock:
+            ws = self.ws
+            try:
+                wire.send(ws, channel, payload, self.proto, self.deflate)
+                return
+            except Exception:
+                pass
+        # the reader notices too, and reconnects; send once more after that
+        self._drop(ws)
+        if not self.connected.wait(SEND_TIMEOUT):
+            raise ConnectionError(f"Not connected to {self.base}")
+        with self.lock:
+            wire.send(self.ws, channel, payload, self.proto, self.deflate)
+    def recv(self, timeout=None):
+        '''The next (channel, payload); TimeoutError after timeout seconds.'''
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"Nothing received for {timeout} seconds") from None
+    def stream(self, channel, timeout=None, other=None):
+        '''
+        Yield the payloads of one reply on channel, up to wire.EOS; messages
+        on other channels go to other(channel, payload) meanwhile.
+        '''
+        while True:
+            c, payload = self.recv(timeout)
+            if c != channel:
+                if other is not None:
+                    other(c, payload)
+            elif payload == wire.EOS:
+                return
+            else:
+                yield payload
+    def close(self) -> None:
+        self.closed = True
+        self.connected.clear()
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            except Exception:
+                pass